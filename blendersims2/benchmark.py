@@ -0,0 +1,458 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+import contextlib
+import io
+import os
+import random
+import shutil
+import struct
+import tempfile
+import time
+import tracemalloc
+import zlib
+
+from blendersims2.fileio import columnindex, crcutils, qfs
+from blendersims2.fileio.datagenerator import DataGenerator
+from blendersims2.fileio.indexer import BackgroundIndexer
+from blendersims2.fileio.package import PackageManager
+from blendersims2.fileio.tgir import MakeDescriptor, PackedFile
+from blendersims2.synthetic import BuildCorpus
+
+def ReferenceDecompress(data, decompsize):
+    """The original byte-at-a-time decompressor, kept as a baseline for checking and timing qfs.decompress. Unlike
+       the original it copies plain text to buffer[wptr:(wptr + num_plain_text)]; the original's slice ended at
+       wptr + num_plain_text - 1, which grew the buffer by a byte for every run of plain text, so its output
+       couldn't be compared."""
+    fh = io.BytesIO(data)
+    def get_byte():
+        return struct.unpack('B', fh.read(1))[0]
+    buffer = bytearray(decompsize)
+    wptr = 0
+    while wptr < decompsize:
+        byte0 = get_byte()
+        if byte0 < 0x80:
+            byte1 = get_byte()
+            num_plain_text = (byte0 & 0x03)
+            num_to_copy = ((byte0 & 0x1c) >> 2) + 3
+            copy_offset = ((byte0 & 0x60) << 3) + byte1 + 1
+        elif byte0 < 0xc0:
+            byte1 = get_byte()
+            byte2 = get_byte()
+            num_plain_text = ((byte1 & 0xc0) >> 6)
+            num_to_copy = (byte0 & 0x3f) + 4
+            copy_offset = ((byte1 & 0x3f) << 8) + byte2 + 1
+        elif byte0 < 0xe0:
+            byte1 = get_byte()
+            byte2 = get_byte()
+            byte3 = get_byte()
+            num_plain_text = (byte0 & 0x03)
+            num_to_copy = ((byte0 & 0x0C) << 6) + byte3 + 5
+            copy_offset = ((byte0 & 0x10) << 12) + (byte1 << 8) + byte2 + 1
+        elif byte0 < 0xfd:
+            num_plain_text = ((byte0 & 0x1F) << 2) + 4
+            num_to_copy = 0
+        else:
+            num_plain_text = (byte0 & 0x03)
+            num_to_copy = 0
+        buffer[wptr:(wptr + num_plain_text)] = struct.unpack('%dB' % num_plain_text, fh.read(num_plain_text))
+        wptr += num_plain_text
+        if num_to_copy > 0:
+            rptr = wptr - copy_offset
+            for _ in range(0, num_to_copy):
+                buffer[wptr] = buffer[rptr]
+                wptr += 1
+                rptr += 1
+    if wptr != decompsize:
+        raise ValueError("Decompressed larger than expected!")
+    return buffer
+
+def SyntheticPayload(size, seed=0):
+    """Mesh-like test data: runs of similar floats and indices with some noise, so it compresses like real resources"""
+    rng = random.Random(seed)
+    out = bytearray()
+    while len(out) < size:
+        kind = rng.randrange(3)
+        if kind == 0:
+            base = rng.uniform(-1.0, 1.0)
+            for _ in range(rng.randrange(4, 64)):
+                out += struct.pack('f', round(base + rng.uniform(-0.01, 0.01), 2))
+        elif kind == 1:
+            start = rng.randrange(0, 10000)
+            out += struct.pack('%dH' % 48, *((start + i // 3) & 0xffff for i in range(48)))
+        else:
+            out += bytes(rng.randrange(256) for _ in range(rng.randrange(1, 32)))
+    return bytes(out[:size])
+
+def Throughput(func, nbytes, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return nbytes / best / (1024 * 1024), best
+
+def BenchmarkDecompress(size=1024*1024, repeat=3, seed=0):
+    """Compare the throughput of qfs.decompress (via DataGenerator) with the reference decompressor"""
+    payload = SyntheticPayload(size, seed)
+    compressed = qfs.compress(payload)
+    body = compressed[qfs.QFS_HEADER_SIZE:]
+    print("Payload %d bytes, compressed to %d bytes (%.1f%%)" % (size, len(compressed), 100.0 * len(compressed) / size))
+
+    if ReferenceDecompress(body, size) != payload:
+        raise RuntimeError("Reference decompressor output does not match the original payload")
+    dg = DataGenerator(io.BytesIO(compressed), 0, len(compressed), size)
+    if dg.decomp_buffer != payload:
+        raise RuntimeError("DataGenerator decompressor output does not match the original payload")
+
+    streamed, retained = StreamAll(compressed, size)
+    if streamed != payload:
+        raise RuntimeError("Streaming decompressor output does not match the original payload")
+
+    ref_rate, ref_time = Throughput(lambda: ReferenceDecompress(body, size), size, repeat)
+    new_rate, new_time = Throughput(lambda: DataGenerator(io.BytesIO(compressed), 0, len(compressed), size), size, repeat)
+    stream_rate, stream_time = Throughput(lambda: StreamAll(compressed, size, keep=False), size, repeat)
+    print("Reference:     %8.2f MB/s (%.3fs)" % (ref_rate, ref_time))
+    print("DataGenerator: %8.2f MB/s (%.3fs)" % (new_rate, new_time))
+    print("Streamed:      %8.2f MB/s (%.3fs, at most %d bytes held)" % (stream_rate, stream_time, retained))
+    print("Speedup:       %8.1fx" % (ref_time / new_time))
+    return ref_time / new_time
+
+def StreamAll(compressed, size, chunk=4096, keep=True):
+    """Read a compressed payload through a streaming DataGenerator chunk bytes at a time. Returns the payload (if
+       keep) and the most decompressed data the stream held at once."""
+    dg = DataGenerator(io.BytesIO(compressed), 0, len(compressed), size, stream=True)
+    out = bytearray()
+    retained = 0
+    while dg.tell() < size:
+        data = dg.read(chunk)
+        if keep:
+            out += data
+        retained = max(retained, len(dg.stream.output))
+    return bytes(out), retained
+
+def ReferenceCRC(inbytes, width, init, poly, inreflect, outreflect, final_xor):
+    """The original bitwise CRC, rebuilding the table entry for every byte, kept to check and time the table-driven one"""
+    table_func = crcutils.crcTable32 if width == 32 else crcutils.crcTable24
+    mask = (1 << width) - 1
+    crc = init
+    for byte in inbytes:
+        if inreflect:
+            curbyte = int('{:08b}'.format(byte)[::-1], 2)
+        else:
+            curbyte = byte
+        pos = (crc ^ (curbyte << (width - 8))) >> (width - 8)
+        crc = ((crc << 8) ^ table_func(pos, poly)) & mask
+    if outreflect:
+        crc = int('{:0{}b}'.format(crc, width)[::-1], 2)
+    return crc ^ final_xor
+
+def SyntheticNames(count, seed=0):
+    rng = random.Random(seed)
+    parts = ('afbody', 'amface', 'puhair', 'cubody', 'teeth', 'eyes', 'tail', 'lod', 'shape', 'tslocator', 'bodyshape')
+    return ['%s_%s_%d_tslod%d' % (rng.choice(parts), rng.choice(parts), rng.randrange(100000), rng.randrange(4))
+            for _ in range(count)]
+
+def CheckCRC(names):
+    """Check the table-driven CRCs give the same results as the reference, raising RuntimeError if not"""
+    for name in names:
+        data = name.lower().encode('ascii')
+        if crcutils.sims2crc32(data) != ReferenceCRC(data, 32, 0xffffffff, 0x04c11db7, False, False, 0):
+            raise RuntimeError("sims2crc32 mismatch for %s" % name)
+        if crcutils.sims2crc24(data) != ReferenceCRC(data, 24, 0x00B704CE, 0x01864CFB, False, False, 0) | 0xFF000000:
+            raise RuntimeError("sims2crc24 mismatch for %s" % name)
+        if crcutils.standard_crc32(data) != zlib.crc32(data):
+            raise RuntimeError("standard_crc32 mismatch for %s" % name)
+        if crcutils.sims2_resource_id(name) != crcutils.sims2crc32(data):
+            raise RuntimeError("sims2_resource_id mismatch for %s" % name)
+    expected = [crcutils.sims2crc32(name.lower().encode('ascii')) for name in names]
+    if crcutils.sims2crc32_many(names) != expected:
+        raise RuntimeError("sims2crc32_many does not match sims2crc32")
+    # Names read from an mmap-backed namemap can arrive as memoryviews
+    if crcutils.sims2crc32_many([memoryview(name.lower().encode('ascii')) for name in names]) != expected:
+        raise RuntimeError("sims2crc32_many does not accept memoryviews")
+
+def BenchmarkCRC(count=5000, repeat=3, seed=0):
+    """Compare the table-driven CRCs with the reference, singly, batched and memoized"""
+    names = SyntheticNames(count, seed)
+    CheckCRC(names)
+    encoded = [name.lower().encode('ascii') for name in names]
+    nbytes = sum(len(data) for data in encoded)
+    print("%d names, %d bytes" % (count, nbytes))
+
+    timings = (("Reference:", lambda: [ReferenceCRC(data, 32, 0xffffffff, 0x04c11db7, False, False, 0) for data in encoded]),
+               ("sims2crc32:", lambda: [crcutils.sims2crc32(data) for data in encoded]),
+               ("sims2crc32_many:", lambda: crcutils.sims2crc32_many(names)),
+               ("sims2_resource_id:", lambda: [crcutils.sims2_resource_id(name) for name in names]))
+    ref_time = None
+    for label, func in timings:
+        rate, elapsed = Throughput(func, nbytes, repeat)
+        if ref_time is None:
+            ref_time = elapsed
+        print("%-19s %8.2f MB/s (%.3fs, %.1fx)" % (label, rate, elapsed, ref_time / elapsed))
+
+def Measure(func, repeat):
+    """Best time of repeat runs of func, then the peak memory allocated during one more run under tracemalloc. The
+       readers print a lot, so their output is discarded."""
+    best = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        tracemalloc.start()
+        try:
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return result, best, peak
+
+def LoadIndices(directory, lazy_rcols=False, columnar_index=False):
+    packman = PackageManager(use_cache=False, lazy_rcols=lazy_rcols, columnar_index=columnar_index)
+    packman.AddDirectory(directory)
+    packman.ReadDBPFIndices(extract_namemaps=True)
+    return packman
+
+def DecompressAll(packman):
+    """Decompress every compressed entry in every package, bypassing the payload cache. Returns the bytes produced."""
+    total = 0
+    for package in packman.packages:
+        with package.filehandle() as fh:
+            package.extract_dircomp(fh)
+            for descriptor, decompressed_size in package.dircomp.items():
+                offset, size, _ = package.index[descriptor]
+                total += len(DataGenerator(fh, offset, size, decompressed_size).decomp_buffer)
+    return total
+
+def ParseAll(packman, rcol_type):
+    """Parse every RCOL of rcol_type in a fresh session, without resolving links"""
+    packman.NewSession()
+    return [packman.GetRCOL(descriptor) for descriptor in list(packman.GetRCOLsByType(rcol_type))]
+
+def LookupAllNames(packman):
+    names = [(rcol_type, name) for package in packman.packages for rcol_type, namemap in (package.namemaps or {}).items()
+             for name in namemap]
+    for rcol_type, name in names:
+        packman.findname(rcol_type, name)
+        crcutils.sims2_resource_id(name)
+    return len(names)
+
+def BuildAllNamemaps(packman):
+    """Build every package's namemaps from its RCOLs, as for packages without an NMAP. Returns the names found."""
+    count = 0
+    for package in packman.packages:
+        package.build_namemaps()
+        count += sum(len(namemap) for namemap in package.namemaps.values())
+    return count
+
+def EnumerateAll(packman):
+    """List the resources of every type through the type index"""
+    return sum(len(list(packman.GetRCOLsByType(rtype))) for rtype in packman.type_index.counts())
+
+def ProbeMisses(packman, count=10000, seed=1):
+    """Look up count random descriptors that aren't in the index, as the file link fallbacks mostly do"""
+    rng = random.Random(seed)
+    gmdc = int(PackedFile.GMDC)
+    for _ in range(count):
+        packman.GetRCOL(MakeDescriptor(gmdc, rng.getrandbits(32), rng.getrandbits(32), rng.getrandbits(32)))
+    return count
+
+def ResolveAll(packman):
+    """Parse every CRES and resolve its links from cold: a fresh session and an empty payload cache"""
+    packman.NewSession()
+    if packman.payload_cache is not None:
+        packman.payload_cache.clear()
+    count = 0
+    for descriptor in list(packman.GetRCOLsByType(PackedFile.CRES)):
+        packman.GetRCOL(descriptor).ResolveAllLinks(packman)
+        count += 1
+    return count
+
+def CheckBackgroundIndexing(directory, workers=None):
+    """Load directory with a BackgroundIndexer, checking progress reaches every package and that the result matches
+       a plain load, then check cancelling as soon as the first package is done leaves a fresh manager empty.
+       Returns the seconds the background load took."""
+    expected = LoadIndices(directory)
+    expected.close()
+    with contextlib.redirect_stdout(io.StringIO()):
+        packman = PackageManager(use_cache=False)
+        packman.AddDirectory(directory)
+        indexer = BackgroundIndexer(packman, extract_namemaps=True, workers=workers).start()
+        indexer.wait()
+    with packman:
+        done, total, bytes_read = indexer.progress()
+        if not (indexer.succeeded() and done == total == len(expected.packages) and bytes_read > 0):
+            raise RuntimeError("Background indexing didn't finish cleanly: %s" % indexer)
+        if set(packman.package_index) != set(expected.package_index):
+            raise RuntimeError("Background indexing gave a different package index to a plain load")
+
+    packman = PackageManager(use_cache=False)
+    packman.AddDirectory(directory)
+    indexer = BackgroundIndexer(packman, workers=workers)
+    original = indexer.update
+    def update(done, total, bytes_read):
+        original(done, total, bytes_read)
+        indexer.cancel()
+    indexer.update = update
+    indexer.start().wait()
+    with packman:
+        if not indexer.cancelled or packman.packages or packman.package_index:
+            raise RuntimeError("Cancelling background indexing didn't leave the manager empty: %s" % indexer)
+    return indexer.elapsed
+
+def CheckCorruptPackages(directory, columnar_index=False):
+    """Load a copy of directory with an empty and a non-DBPF .package added, through a BackgroundIndexer, checking
+       the bad files are skipped rather than stopping the load or a refresh"""
+    expected = LoadIndices(directory)
+    expected.close()
+    with tempfile.TemporaryDirectory() as copy:
+        for file in os.listdir(directory):
+            if file.endswith('.package'):
+                shutil.copy(os.path.join(directory, file), copy)
+        open(os.path.join(copy, 'empty.package'), 'wb').close()
+        with open(os.path.join(copy, 'junk.package'), 'wb') as fh:
+            fh.write(b'Not a package' * 10)
+        with contextlib.redirect_stdout(io.StringIO()):
+            packman = PackageManager(use_cache=False, columnar_index=columnar_index)
+            packman.AddDirectory(copy)
+            indexer = BackgroundIndexer(packman, extract_namemaps=True).start()
+            indexer.wait()
+        with packman:
+            if not indexer.succeeded():
+                raise RuntimeError("Loading with corrupt packages failed: %s: %s" % (indexer, indexer.error))
+            if len(packman.package_index) != len(expected.package_index):
+                raise RuntimeError("Loading with corrupt packages gave a different package index")
+            # With packages already loaded the indexer refreshes instead
+            with open(os.path.join(copy, 'junk.package'), 'ab') as fh:
+                fh.write(b'Still not a package')
+            with contextlib.redirect_stdout(io.StringIO()):
+                indexer = BackgroundIndexer(packman, extract_namemaps=True).start()
+                indexer.wait()
+            if not indexer.succeeded():
+                raise RuntimeError("Refreshing with corrupt packages failed: %s: %s" % (indexer, indexer.error))
+            if len(packman.package_index) != len(expected.package_index):
+                raise RuntimeError("Refreshing with corrupt packages gave a different package index")
+
+def CheckTruncatedIndexCache(directory):
+    """Load directory through an index cache with its end cut off, checking the cache is discarded as corrupt and
+       the packages are read from disk instead"""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache_file = os.path.join(cache_dir, 'dbpfindex.cache')
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = PackageManager(cache_file=cache_file)
+            expected.AddDirectory(directory)
+            expected.ReadDBPFIndices(extract_namemaps=True)
+        expected.close()
+        with open(cache_file, 'r+b') as fh:
+            fh.truncate(os.path.getsize(cache_file) - 8)
+        with contextlib.redirect_stdout(io.StringIO()):
+            packman = PackageManager(cache_file=cache_file)
+            packman.AddDirectory(directory)
+        with packman:
+            if packman.cache.records:
+                raise RuntimeError("Truncated index cache loaded %d records" % len(packman.cache.records))
+            with contextlib.redirect_stdout(io.StringIO()):
+                packman.ReadDBPFIndices(extract_namemaps=True)
+            if len(packman.package_index) != len(expected.package_index):
+                raise RuntimeError("Loading past a truncated index cache gave a different package index")
+
+def CheckBlockIndexBuild(directory):
+    """Build block indices for directory after warming the payload cache, checking the build leaves it alone"""
+    with tempfile.TemporaryDirectory() as block_index_dir:
+        with contextlib.redirect_stdout(io.StringIO()):
+            packman = PackageManager(use_cache=False, lazy_rcols=True, block_index_dir=block_index_dir)
+            packman.AddDirectory(directory)
+            packman.ReadDBPFIndices(extract_namemaps=True)
+        with packman:
+            with contextlib.redirect_stdout(io.StringIO()):
+                ParseAll(packman, PackedFile.GMDC)
+            cached = list(packman.payload_cache.entries)
+            if not cached:
+                raise RuntimeError("Parsing GMDCs didn't cache any payloads")
+            with contextlib.redirect_stdout(io.StringIO()):
+                packman.BuildBlockIndices()
+            if list(packman.payload_cache.entries) != cached:
+                raise RuntimeError("Building block indices changed the payload cache: %s" % packman.payload_cache)
+
+def BenchmarkSuite(directory=None, packages=4, chains=8, vertices=1000, transforms=4, lods=1, compress=True, repeat=3):
+    """Build a synthetic corpus (in a temporary directory unless one is given) and time index load, listing by type,
+       decompression, GMDC and CRES parsing, name lookup and full link resolution over it, eager, lazy and with the
+       columnar index. Returns {stage: (rate, unit, seconds, peak bytes)}."""
+    with contextlib.ExitStack() as stack:
+        if directory is None:
+            directory = stack.enter_context(tempfile.TemporaryDirectory())
+        cres_ids = BuildCorpus(directory, packages, chains, vertices, transforms, lods, compress)
+        files = [os.path.join(directory, file) for file in os.listdir(directory) if file.endswith('.package')]
+        corpus_bytes = sum(os.path.getsize(file) for file in files)
+        print("Corpus: %d packages, %d bytes, %d CRES chains of %d vertices" % (len(files), corpus_bytes, len(cres_ids), vertices))
+
+        results = {}
+        def report(stage, count, unit, elapsed, peak):
+            rate = count / elapsed
+            results[stage] = (rate, unit, elapsed, peak)
+            print("%-20s %12.1f %-12s (%.3fs, peak %.1f MB)" % (stage, rate, unit, elapsed, peak / (1024 * 1024)))
+
+        packman, elapsed, peak = Measure(lambda: LoadIndices(directory), repeat)
+        report("Index load", len(files), "packages/s", elapsed, peak)
+        with packman:
+            count, elapsed, peak = Measure(lambda: EnumerateAll(packman), repeat)
+            report("Enumerate by type", count, "entries/s", elapsed, peak)
+            nbytes, elapsed, peak = Measure(lambda: DecompressAll(packman), repeat)
+            report("Decompression", nbytes / (1024 * 1024), "MB/s", elapsed, peak)
+            # Warm the payload cache so only parsing is timed
+            with contextlib.redirect_stdout(io.StringIO()):
+                ParseAll(packman, PackedFile.GMDC)
+            gmdcs, elapsed, peak = Measure(lambda: ParseAll(packman, PackedFile.GMDC), repeat)
+            report("GMDC parse", len(gmdcs) * vertices, "vertices/s", elapsed, peak)
+            # Decompressing as the parser reads, with nothing cached so every GMDC is streamed
+            streaming = PackageManager(use_cache=False, max_payload_bytes=0, stream_threshold=0)
+            streaming.AddDirectory(directory)
+            with contextlib.redirect_stdout(io.StringIO()):
+                streaming.ReadDBPFIndices()
+            with streaming:
+                gmdcs, elapsed, peak = Measure(lambda: ParseAll(streaming, PackedFile.GMDC), repeat)
+                report("Streamed GMDC parse", len(gmdcs) * vertices, "vertices/s", elapsed, peak)
+            cres, elapsed, peak = Measure(lambda: ParseAll(packman, PackedFile.CRES), repeat)
+            report("CRES parse", sum(len(rcol.rcoldata) for rcol in cres), "blocks/s", elapsed, peak)
+            count, elapsed, peak = Measure(lambda: LookupAllNames(packman), repeat)
+            report("Name lookup", count, "names/s", elapsed, peak)
+            count, elapsed, peak = Measure(lambda: BuildAllNamemaps(packman), repeat)
+            report("Namemap build", count, "names/s", elapsed, peak)
+            count, elapsed, peak = Measure(lambda: ResolveAll(packman), repeat)
+            report("Resolution", count, "CRES/s", elapsed, peak)
+        elapsed = CheckBackgroundIndexing(directory)
+        print("Background indexing checked (%.3fs)" % elapsed)
+        CheckCorruptPackages(directory)
+        print("Corrupt packages checked")
+        CheckBlockIndexBuild(directory)
+        print("Block index build checked")
+        CheckTruncatedIndexCache(directory)
+        print("Truncated index cache checked")
+        with contextlib.redirect_stdout(io.StringIO()):
+            packman = LoadIndices(directory, lazy_rcols=True)
+        with packman:
+            count, elapsed, peak = Measure(lambda: ResolveAll(packman), repeat)
+            report("Lazy resolution", count, "CRES/s", elapsed, peak)
+        if columnindex.numpy is not None:
+            CheckCorruptPackages(directory, columnar_index=True)
+            print("Corrupt packages checked with the columnar index")
+            packman, elapsed, peak = Measure(lambda: LoadIndices(directory, columnar_index=True), repeat)
+            report("Columnar load", len(files), "packages/s", elapsed, peak)
+            with packman:
+                count, elapsed, peak = Measure(lambda: ResolveAll(packman), repeat)
+                report("Columnar resolution", count, "CRES/s", elapsed, peak)
+                count, elapsed, peak = Measure(lambda: ProbeMisses(packman), repeat)
+                report("Filtered misses", count, "lookups/s", elapsed, peak)
+                probes, negatives = packman.FilterStats()
+                print("Bloom filters: %d probes, %d ruled out" % (probes, negatives))
+        return results
+
+if __name__ == "__main__":
+    BenchmarkDecompress()
+    BenchmarkCRC()
+    BenchmarkSuite()
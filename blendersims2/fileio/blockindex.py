@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+import hashlib
+import os
+import struct
+
+from blendersims2.fileio.tgir import DecodeDescriptor, DescriptorToBytes, MakeDescriptor
+
+def DefaultBlockIndexDirectory():
+    return os.path.join(os.path.expanduser('~'), '.blendersims2', 'blocks')
+
+class BlockIndex:
+    """Sidecar index of the RCOLs in one package: for each, the file links and RCOL IDs from its header and the
+       offsets of its data blocks from the start of the (decompressed) RCOL. Built once by parsing every RCOL, then
+       saved and reused until the package's size or modification time changes. Lets links be listed without
+       reading the RCOL at all, and any block be read without parsing the blocks before it."""
+
+    MAGIC = b'BS2B'
+    VERSION = 1
+
+    FileHeader = struct.Struct('<4sIQQII')      # Magic, version, size, mtime_ns, path length, entry count (path follows)
+    Entry = struct.Struct('<16sBHHH')           # Packed descriptor, version mark, link count, RCOL ID count, offset count
+
+    def __init__(self, package_path, directory=None):
+        self.package_path = package_path
+        directory = directory if directory else DefaultBlockIndexDirectory()
+        name = hashlib.sha1(package_path.encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(directory, name + '.blk')
+        self.entries = {}    # Descriptor -> (version mark, links as (type, group, instance, resource), RCOL IDs, offsets)
+
+    def load(self, stat, verbose=False):
+        """Read the sidecar. Returns False if there isn't one for this version of the package."""
+        self.entries = {}
+        try:
+            with open(self.path, 'rb') as fh:
+                data = fh.read()
+        except OSError:
+            return False
+        try:
+            magic, version, size, mtime_ns, pathlen, count = self.FileHeader.unpack_from(data, 0)
+            ptr = self.FileHeader.size
+            path = data[ptr:(ptr + pathlen)].decode('utf-8')
+            ptr += pathlen
+            if (magic != self.MAGIC or version != self.VERSION or path != self.package_path or size != stat.st_size or
+                    mtime_ns != stat.st_mtime_ns):
+                if verbose:
+                    print("Block index %s is out of date" % self.path)
+                return False
+            entries = {}
+            for _ in range(count):
+                descriptor, version_mark, nlinks, nids, noffsets = self.Entry.unpack_from(data, ptr)
+                ptr += self.Entry.size
+                values = struct.unpack_from('<%dI' % (nlinks * 4 + nids + noffsets), data, ptr)
+                ptr += 4 * len(values)
+                links = tuple(tuple(values[(index * 4):(index * 4 + 4)]) for index in range(nlinks))
+                rcol_ids = values[(nlinks * 4):(nlinks * 4 + nids)]
+                offsets = values[(nlinks * 4 + nids):]
+                entries[int.from_bytes(descriptor, 'little')] = (bool(version_mark), links, rcol_ids, offsets)
+        except (struct.error, UnicodeDecodeError):
+            print("Block index %s is corrupt, ignoring it" % self.path)
+            return False
+        self.entries = entries
+        if verbose:
+            print("Loaded block index %s with %d RCOLs" % (self.path, len(self.entries)))
+        return True
+
+    def save(self, stat, verbose=False):
+        encoded_path = self.package_path.encode('utf-8')
+        chunks = [self.FileHeader.pack(self.MAGIC, self.VERSION, stat.st_size, stat.st_mtime_ns, len(encoded_path),
+                                       len(self.entries)), encoded_path]
+        for descriptor, (version_mark, links, rcol_ids, offsets) in self.entries.items():
+            chunks.append(self.Entry.pack(DescriptorToBytes(descriptor), int(version_mark), len(links), len(rcol_ids),
+                                          len(offsets)))
+            values = [value for link in links for value in link] + list(rcol_ids) + list(offsets)
+            chunks.append(struct.pack('<%dI' % len(values), *values))
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as fh:
+            fh.write(b''.join(chunks))
+        os.replace(tmp, self.path)
+        if verbose:
+            print("Saved block index %s with %d RCOLs" % (self.path, len(self.entries)))
+
+    def build(self, package, verbose=False):
+        """Parse every RCOL in DBPF package, recording its header and block offsets"""
+        if verbose:
+            print("Building block index for " + package.file)
+        self.entries = {}
+        for descriptor in package.index:
+            identifier = DecodeDescriptor(descriptor)
+            if not identifier.type.is_rcol():
+                continue
+            try:
+                # Bypass the payload cache, or indexing a whole install would evict what's actually in use
+                rcol = package.get_RCOL(descriptor, lazy=True, use_payload_cache=False)
+                # Walk the blocks to find where each starts; a failure part way leaves the offsets found so far
+                try:
+                    for _ in rcol.rcoldata:
+                        pass
+                except Exception as err:
+                    print("Failed to parse all blocks of %s: %s" % (str(identifier), err))
+            except Exception as err:
+                print("Failed to read RCOL %s: %s" % (str(identifier), err))
+                continue
+            links = tuple((int(link.type), link.group, link.instance, link.resource) for link in rcol.header.filelinks)
+            rcol_ids = tuple(int(rcol_id) for rcol_id in rcol.header.rcol_ids)
+            self.entries[descriptor] = (rcol.header.version_mark, links, rcol_ids, tuple(rcol.get_block_offsets()))
+
+    def get(self, descriptor):
+        return self.entries.get(descriptor)
+
+    def get_links(self, descriptor):
+        """Descriptors of the RCOLs linked to, or None if descriptor isn't in the index"""
+        entry = self.entries.get(descriptor)
+        if entry is None:
+            return None
+        return [MakeDescriptor(*link) for link in entry[1]]
+
+    def get_offsets(self, descriptor):
+        entry = self.entries.get(descriptor)
+        return entry[3] if entry else None
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+class BloomFilter:
+    """Probabilistic set of descriptors: says for certain when a descriptor is not in a package's (or the global)
+       index, so the fallback lookups made while resolving links can give up without touching the index or a file.
+       A hit may be a false positive and still needs the real lookup. Counts the probes it answers.
+
+       Uses a byte rather than a bit per slot, and three probe positions taken from separate 40 bit slices of one
+       multiplicative hash, which keeps a probe to a handful of Python operations."""
+
+    SLOTS_PER_ENTRY = 12    # With 3 probes, about 1% false positives
+    MULTIPLIER = 0x9E3779B97F4A7C15
+
+    def __init__(self, capacity):
+        size = 64
+        while size < capacity * self.SLOTS_PER_ENTRY:
+            size <<= 1
+        self.capacity = capacity
+        self.mask = size - 1
+        self.slots = bytearray(size)
+        self.entries = 0
+        self.probes = 0
+        self.negatives = 0
+
+    def add(self, descriptor):
+        self.add_many((descriptor,))
+
+    def add_many(self, descriptors):
+        slots = self.slots
+        mask = self.mask
+        multiplier = self.MULTIPLIER
+        count = 0
+        for descriptor in descriptors:
+            h = hash(descriptor) * multiplier
+            slots[h & mask] = 1
+            slots[(h >> 40) & mask] = 1
+            slots[(h >> 80) & mask] = 1
+            count += 1
+        self.entries += count
+
+    def might_contain(self, descriptor):
+        """False if descriptor was definitely never added"""
+        self.probes += 1
+        h = hash(descriptor) * self.MULTIPLIER
+        slots = self.slots
+        mask = self.mask
+        if slots[h & mask] and slots[(h >> 40) & mask] and slots[(h >> 80) & mask]:
+            return True
+        self.negatives += 1
+        return False
+
+    def __len__(self):
+        return self.entries
+
+    def __str__(self):
+        return "%d entries in %d bytes, %d probes, %d ruled out" % (self.entries, len(self.slots), self.probes,
+                                                                   self.negatives)
@@ -0,0 +1,342 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from blendersims2.fileio.tgir import MakeDescriptor, SplitDescriptor, DESCRIPTOR_FIELD_MASK, DESCRIPTOR_RESOURCE_SHIFT
+
+# Rows are sorted on (k1, k2, package) where k1 = type << 32 | group and k2 = instance << 32 | resource, which keeps
+# each type together in (group, instance, resource) order, and copies of a descriptor in package order
+KeyType = numpy.dtype([('k1', '<u8'), ('k2', '<u8')]) if numpy is not None else None
+
+MAX_K2 = 0xffffffffffffffff
+
+def SplitKey(descriptor):
+    """(k1, k2) for descriptor"""
+    return (((descriptor & DESCRIPTOR_FIELD_MASK) << 32 | ((descriptor >> 32) & DESCRIPTOR_FIELD_MASK)),
+            (((descriptor >> 64) & DESCRIPTOR_FIELD_MASK) << 32 | (descriptor >> DESCRIPTOR_RESOURCE_SHIFT)))
+
+class ColumnIndex:
+    """Alternative to the dict based package index for very large installs: every index entry of every package held
+       as a row of NumPy columns (sort key, package, offset, size, decompressed size), sorted so lookups are a binary
+       search and per-type work is on contiguous slices. Entries overridden by later packages are kept, so each
+       package can still see its own index, but only the last copy of each descriptor counts for global lookups and
+       listings. Needs NumPy."""
+
+    def __init__(self):
+        if numpy is None:
+            raise ImportError("The columnar index needs NumPy")
+        self.packages = []
+        self.k1 = numpy.empty(0, '<u8')
+        self.k2 = numpy.empty(0, '<u8')
+        self.package_ids = numpy.empty(0, '<u4')
+        self.offsets = numpy.empty(0, '<u4')
+        self.sizes = numpy.empty(0, '<u4')
+        self.decompressed_sizes = numpy.empty(0, '<u4')    # 0 if not compressed
+        self.winners = numpy.empty(0, bool)                 # Whether a row is the last copy of its descriptor
+        self.package_rows = numpy.empty(0, '<u4')           # Rows grouped by package, each group in key order
+        self.package_starts = numpy.zeros(1, '<u4')
+        self.extra_dircomp = []    # Per package, CLST entries with no index entry (NMAPs), as descriptor -> size
+        self.type_counts = {}
+        self.unique = 0
+
+    # Descriptor fields, as views of the sort keys
+    @property
+    def types(self):
+        return self.k1.view('<u4')[1::2]
+
+    @property
+    def groups(self):
+        return self.k1.view('<u4')[0::2]
+
+    @property
+    def instances(self):
+        return self.k2.view('<u4')[1::2]
+
+    @property
+    def resources(self):
+        return self.k2.view('<u4')[0::2]
+
+    def build(self, packages, verbose=False):
+        """Build the columns from the packages' indices, which can be dicts or views of an older ColumnIndex, then
+           read their CLSTs for the decompressed sizes"""
+        self.packages = list(packages)
+        chunks = []
+        for position, package in enumerate(self.packages):
+            items = list(package.index.items())
+            count = len(items)
+            descriptors = numpy.frombuffer(b''.join(descriptor.to_bytes(16, 'little') for descriptor, _ in items),
+                                           '<u4').reshape(count, 4)
+            locations = numpy.array([location[0:2] for _, location in items], '<u4').reshape(count, 2)
+            chunks.append((descriptors, numpy.full(count, position, '<u4'), locations))
+        if chunks:
+            descriptors = numpy.concatenate([chunk[0] for chunk in chunks])
+            package_ids = numpy.concatenate([chunk[1] for chunk in chunks])
+            locations = numpy.concatenate([chunk[2] for chunk in chunks])
+        else:
+            descriptors = numpy.empty((0, 4), '<u4')
+            package_ids = numpy.empty(0, '<u4')
+            locations = numpy.empty((0, 2), '<u4')
+        k1 = descriptors[:, 0].astype('<u8') << 32 | descriptors[:, 1]
+        k2 = descriptors[:, 2].astype('<u8') << 32 | descriptors[:, 3]
+        order = numpy.lexsort((package_ids, k2, k1))
+        self.k1 = k1[order]
+        self.k2 = k2[order]
+        self.package_ids = package_ids[order]
+        self.offsets = numpy.ascontiguousarray(locations[order, 0])
+        self.sizes = numpy.ascontiguousarray(locations[order, 1])
+        self.decompressed_sizes = numpy.zeros(len(order), '<u4')
+
+        self.winners = numpy.ones(len(order), bool)
+        self.winners[:-1] = (self.k1[:-1] != self.k1[1:]) | (self.k2[:-1] != self.k2[1:])
+        self.unique = int(numpy.count_nonzero(self.winners))
+        types, counts = numpy.unique(self.k1[self.winners] >> 32, return_counts=True)
+        self.type_counts = dict(zip(types.tolist(), counts.tolist()))
+
+        self.package_rows = numpy.argsort(self.package_ids, kind='stable').astype('<u4')
+        self.package_starts = numpy.searchsorted(self.package_ids[self.package_rows],
+                                                 numpy.arange(len(self.packages) + 1)).astype('<u4')
+
+        self.extra_dircomp = []
+        for position, package in enumerate(self.packages):
+            self.extra_dircomp.append(self.join_clst(position, package))
+        if verbose:
+            print("Columnar index: %s, %d bytes" % (str(self), self.nbytes()))
+
+    def read_clst(self, package):
+        """A package's CLST as an (n, 5) array of type, group, instance, resource, decompressed size. The raw CLST is
+           normally kept from when the index was read, or in the index cache, so the package isn't opened."""
+        data = package.dircomp_data
+        if data is None and isinstance(package.dircomp, dict):
+            # Already decoded, by a reader that didn't keep the raw data
+            rows = [SplitDescriptor(descriptor) + (size,) for descriptor, size in package.dircomp.items()]
+            return numpy.array(rows, '<u4').reshape(len(rows), 5)
+        if not package.dircomp_location:
+            return numpy.empty((0, 5), '<u4')
+        if data is None:
+            offset, size = package.dircomp_location
+            with package.filehandle() as fh:
+                fh.seek(offset)
+                data = package.dircomp_data = fh.read(size)
+        fields = 5 if package.indexver.minor == 2 else 4
+        if len(data) % (fields * 4) != 0:
+            raise ValueError("Size of directory of compressed files is not a multiple of %d: got %d, version %s, file = \"%s\"" % (fields * 4, len(data), str(package.indexver), package.file))
+        rows = numpy.frombuffer(data, '<u4').reshape(-1, fields)
+        if fields == 4:
+            rows = numpy.insert(rows, 3, 0, axis=1)
+        return rows
+
+    def join_clst(self, position, package):
+        """Fill in decompressed sizes for a package's rows from its CLST. Returns the CLST entries that aren't in the
+           index."""
+        rows = self.read_clst(package)
+        query = numpy.empty(len(rows), KeyType)
+        query['k1'] = rows[:, 0].astype('<u8') << 32 | rows[:, 1]
+        query['k2'] = rows[:, 2].astype('<u8') << 32 | rows[:, 3]
+        # The package's own rows are in key order, and each key appears once
+        package_rows = self.get_package_rows(position)
+        keys = numpy.empty(len(package_rows), KeyType)
+        keys['k1'] = self.k1[package_rows]
+        keys['k2'] = self.k2[package_rows]
+        found = numpy.searchsorted(keys, query)
+        matched = found < len(keys)
+        matched[matched] = keys[found[matched]] == query[matched]
+        self.decompressed_sizes[package_rows[found[matched]]] = rows[matched, 4]
+        return {MakeDescriptor(*row[0:4]): row[4] for row in rows[~matched].tolist()}
+
+    def find(self, descriptor, package=None):
+        """Row of descriptor, the last copy or the one in package position package, or -1"""
+        # Search with NumPy scalars: Python ints this big are compared as floats
+        k1, k2 = (numpy.uint64(key) for key in SplitKey(descriptor))
+        start = int(numpy.searchsorted(self.k1, k1))
+        end = int(numpy.searchsorted(self.k1, k1, 'right'))
+        if start == end:
+            return -1
+        k2s = self.k2[start:end]
+        end = start + int(numpy.searchsorted(k2s, k2, 'right'))
+        start += int(numpy.searchsorted(k2s, k2))
+        if start == end:
+            return -1
+        if package is None:
+            return end - 1
+        row = start + int(numpy.searchsorted(self.package_ids[start:end], package))
+        return row if row < end and self.package_ids[row] == package else -1
+
+    def get_package(self, row):
+        return self.packages[int(self.package_ids[row])]
+
+    def get_location(self, row):
+        return int(self.offsets[row]), int(self.sizes[row])
+
+    def get_descriptors(self, rows):
+        """Descriptors of an array of rows"""
+        return [(k1 >> 32) | (k1 & DESCRIPTOR_FIELD_MASK) << 32 | (k2 >> 32) << 64 | (k2 & DESCRIPTOR_FIELD_MASK) << 96
+                for k1, k2 in zip(self.k1[rows].tolist(), self.k2[rows].tolist())]
+
+    def get_package_rows(self, package):
+        return self.package_rows[self.package_starts[package]:self.package_starts[package + 1]]
+
+    def key_range(self, k1_low, k1_high, k2_low=0, k2_high=MAX_K2):
+        """(start, end) rows with k1_low <= k1 <= k1_high, also limited by k2 where k1 is at either end"""
+        k1_low, k1_high, k2_low, k2_high = (numpy.uint64(key) for key in (k1_low, k1_high, k2_low, k2_high))
+        start = int(numpy.searchsorted(self.k1, k1_low))
+        if k2_low:
+            low_end = int(numpy.searchsorted(self.k1, k1_low, 'right'))
+            start += int(numpy.searchsorted(self.k2[start:low_end], k2_low))
+        end = int(numpy.searchsorted(self.k1, k1_high, 'right'))
+        if k2_high != MAX_K2:
+            high_start = max(start, int(numpy.searchsorted(self.k1, k1_high)))
+            end = high_start + int(numpy.searchsorted(self.k2[high_start:end], k2_high, 'right'))
+        return start, max(start, end)
+
+    def select(self, rtype, group=None, instance_min=None, instance_max=None):
+        """Rows of the resources of type rtype, optionally only those in group and in an instance range"""
+        rtype = int(rtype)
+        if group is not None:
+            low = 0 if instance_min is None else instance_min << 32
+            high = MAX_K2 if instance_max is None else (instance_max << 32) | DESCRIPTOR_FIELD_MASK
+            start, end = self.key_range(rtype << 32 | group, rtype << 32 | group, low, high)
+            mask = self.winners[start:end]
+        else:
+            start, end = self.key_range(rtype << 32, rtype << 32 | DESCRIPTOR_FIELD_MASK)
+            mask = self.winners[start:end].copy()
+            if instance_min is not None or instance_max is not None:
+                instances = self.instances[start:end]
+                if instance_min is not None:
+                    mask &= instances >= instance_min
+                if instance_max is not None:
+                    mask &= instances <= instance_max
+        return numpy.flatnonzero(mask) + start
+
+    def descriptors(self, rtype, group=None, instance_min=None, instance_max=None):
+        """Descriptors of type rtype in (group, instance, resource) order, as TypeIndex.descriptors"""
+        return iter(self.get_descriptors(self.select(rtype, group, instance_min, instance_max)))
+
+    def count(self, rtype):
+        return self.type_counts.get(int(rtype), 0)
+
+    def counts(self):
+        return dict(self.type_counts)
+
+    def nbytes(self):
+        return sum(column.nbytes for column in (self.k1, self.k2, self.package_ids, self.offsets, self.sizes,
+                                                self.decompressed_sizes, self.winners, self.package_rows,
+                                                self.package_starts))
+
+    def clear(self):
+        self.__init__()
+
+    def __len__(self):
+        return self.unique
+
+    def __str__(self):
+        return "%d resources of %d types in %d rows" % (self.unique, len(self.type_counts), len(self.k1))
+
+class ColumnPackageIndex:
+    """Descriptor -> package mapping over a ColumnIndex, standing in for PackageManager.package_index"""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __contains__(self, descriptor):
+        return self.columns.find(descriptor) >= 0
+
+    def __getitem__(self, descriptor):
+        row = self.columns.find(descriptor)
+        if row < 0:
+            raise KeyError(descriptor)
+        return self.columns.get_package(row)
+
+    def get(self, descriptor, default=None):
+        row = self.columns.find(descriptor)
+        return self.columns.get_package(row) if row >= 0 else default
+
+    def __iter__(self):
+        return iter(self.columns.get_descriptors(numpy.flatnonzero(self.columns.winners)))
+
+    def items(self):
+        rows = numpy.flatnonzero(self.columns.winners)
+        packages = self.columns.packages
+        return zip(self.columns.get_descriptors(rows), (packages[package] for package in
+                                                         self.columns.package_ids[rows].tolist()))
+
+    def __len__(self):
+        return len(self.columns)
+
+class PackageIndexView:
+    """Descriptor -> (offset, size, index version) mapping over one package's rows of a ColumnIndex, standing in for
+       DBPF.index"""
+
+    def __init__(self, columns, package, ver):
+        self.columns = columns
+        self.package = package
+        self.ver = ver
+
+    def __contains__(self, descriptor):
+        return self.columns.find(descriptor, self.package) >= 0
+
+    def __getitem__(self, descriptor):
+        row = self.columns.find(descriptor, self.package)
+        if row < 0:
+            raise KeyError(descriptor)
+        return self.columns.get_location(row) + (self.ver,)
+
+    def get(self, descriptor, default=None):
+        return self[descriptor] if descriptor in self else default
+
+    def __iter__(self):
+        return iter(self.columns.get_descriptors(self.columns.get_package_rows(self.package)))
+
+    def items(self):
+        rows = self.columns.get_package_rows(self.package)
+        ver = self.ver
+        return zip(self.columns.get_descriptors(rows), ((offset, size, ver) for offset, size in
+                                                         zip(self.columns.offsets[rows].tolist(),
+                                                             self.columns.sizes[rows].tolist())))
+
+    def __len__(self):
+        return len(self.columns.get_package_rows(self.package))
+
+class PackageDircompView:
+    """Descriptor -> decompressed size mapping over one package's rows of a ColumnIndex, plus any CLST entries not in
+       the index, standing in for DBPF.dircomp"""
+
+    def __init__(self, columns, package):
+        self.columns = columns
+        self.package = package
+        self.extra = columns.extra_dircomp[package]
+
+    def __contains__(self, descriptor):
+        if descriptor in self.extra:
+            return True
+        row = self.columns.find(descriptor, self.package)
+        return row >= 0 and self.columns.decompressed_sizes[row] != 0
+
+    def __getitem__(self, descriptor):
+        if descriptor in self.extra:
+            return self.extra[descriptor]
+        row = self.columns.find(descriptor, self.package)
+        if row < 0 or self.columns.decompressed_sizes[row] == 0:
+            raise KeyError(descriptor)
+        return int(self.columns.decompressed_sizes[row])
+
+    def get(self, descriptor, default=None):
+        return self[descriptor] if descriptor in self else default
+
+    def compressed_rows(self):
+        rows = self.columns.get_package_rows(self.package)
+        return rows[self.columns.decompressed_sizes[rows] != 0]
+
+    def __iter__(self):
+        return iter(self.columns.get_descriptors(self.compressed_rows()) + list(self.extra))
+
+    def items(self):
+        rows = self.compressed_rows()
+        return list(zip(self.columns.get_descriptors(rows), self.columns.decompressed_sizes[rows].tolist())) + \
+            list(self.extra.items())
+
+    def __len__(self):
+        return len(self.compressed_rows()) + len(self.extra)
@@ -1,6 +1,9 @@
 #!/usr/bin/python3
 #-*- coding: utf-8 -*-
 
+import functools
+import zlib
+
 def crcTable24(byte, poly):
     curbyte = byte << 16
     for _ in range(8):
@@ -10,21 +13,6 @@ def crcTable24(byte, poly):
         else:
             curbyte <<= 1
     return curbyte
-    
-def generic_crc24(inbytes, init, poly, inreflect, outreflect, final_xor):
-    crc = init
-    for byte in inbytes:
-        if inreflect:
-            curbyte = int('{:08b}'.format(byte)[::-1], 2)
-        else:
-            curbyte = byte
-        pos = (crc ^ (curbyte << 16)) >> 16
-        crc = ((crc << 8) ^ crcTable24(pos, poly)) & 0xffffff
-    if outreflect:
-        final_crc = int('{:024b}'.format(crc)[::-1], 2)
-    else:
-        final_crc = crc
-    return final_crc ^ final_xor
 
 def crcTable32(byte, poly):
     curbyte = byte << 24
@@ -35,27 +23,73 @@ def crcTable32(byte, poly):
         else:
             curbyte <<= 1
     return curbyte
-    
+
+# Byte values with their bits reversed, for reflected input
+ReflectedBytes = tuple(int('{:08b}'.format(byte)[::-1], 2) for byte in range(256))
+ReflectTable = bytes(ReflectedBytes)    # For bytes.translate
+
+# 256 entry lookup tables by (poly, width), masked to the CRC width
+_crc_tables = {}
+
+def crc_table(poly, width):
+    table = _crc_tables.get((poly, width))
+    if table is None:
+        table_func = crcTable32 if width == 32 else crcTable24
+        mask = (1 << width) - 1
+        table = tuple(table_func(pos, poly) & mask for pos in range(256))
+        _crc_tables[(poly, width)] = table
+    return table
+
+def reflect(value, width):
+    return int('{:0{}b}'.format(value, width)[::-1], 2)
+
+def generic_crc24(inbytes, init, poly, inreflect, outreflect, final_xor):
+    table = crc_table(poly, 24)
+    crc = init
+    if inreflect:
+        inbytes = bytes(ReflectedBytes[byte] for byte in inbytes)
+    for byte in inbytes:
+        crc = ((crc << 8) & 0xffffff) ^ table[((crc >> 16) ^ byte) & 0xff]
+    if outreflect:
+        crc = reflect(crc, 24)
+    return crc ^ final_xor
+
 def generic_crc32(inbytes, init, poly, inreflect, outreflect, final_xor):
+    table = crc_table(poly, 32)
     crc = init
+    if inreflect:
+        inbytes = bytes(ReflectedBytes[byte] for byte in inbytes)
     for byte in inbytes:
-        if inreflect:
-            curbyte = int('{:08b}'.format(byte)[::-1], 2)
-        else:
-            curbyte = byte
-        pos = (crc ^ (curbyte << 24)) >> 24
-        crc = ((crc << 8) ^ crcTable32(pos, poly)) & 0xffffffff
+        crc = ((crc << 8) & 0xffffffff) ^ table[(crc >> 24) ^ byte]
     if outreflect:
-        final_crc = int('{:032b}'.format(crc)[::-1], 2)
-    else:
-        final_crc = crc
-    return final_crc ^ final_xor
+        crc = reflect(crc, 32)
+    return crc ^ final_xor
+
+# Build the table for the CRC24 the Sims 2 uses up front; its CRC32 goes through zlib
+SIMS2_CRC24_TABLE = crc_table(0x01864CFB, 24)
 
 def sims2crc32(inbytes):
-    return generic_crc32(inbytes, init=0xffffffff, poly=0x04c11db7, inreflect=False, outreflect=False, final_xor=0x00000000)
-    
+    # The Sims 2 CRC32 is the standard (zlib) CRC32 without the bit reflection or final XOR, so let zlib do the work
+    # on bit-reversed input and reverse the result back
+    crc = zlib.crc32(bytes(inbytes).translate(ReflectTable)) ^ 0xffffffff
+    return int.from_bytes(crc.to_bytes(4, 'little').translate(ReflectTable), 'big')
+
+def sims2crc32_many(names):
+    """CRC32s of a batch of names; str names are lowercased and encoded as ASCII first, as for resource IDs"""
+    return [sims2crc32(name.lower().encode('ascii') if isinstance(name, str) else name) for name in names]
+
+@functools.lru_cache(maxsize=65536)
+def sims2_resource_id(name):
+    """Resource ID of a named RCOL, the Sims 2 CRC32 of its lowercased name, memoized as the same names are hashed
+       over and over while resolving links"""
+    return sims2crc32(name.lower().encode('ascii'))
+
 def standard_crc32(inbytes):
     return generic_crc32(inbytes, init=0xffffffff, poly=0x04c11db7, inreflect=True, outreflect=True, final_xor=0xffffffff)
 
 def sims2crc24(inbytes):
-    return generic_crc24(inbytes, init=0x00B704CE, poly=0x01864CFB, inreflect=False, outreflect=False, final_xor=0x00000000) | 0xFF000000
+    crc = 0x00B704CE
+    table = SIMS2_CRC24_TABLE
+    for byte in inbytes:
+        crc = ((crc << 8) & 0xffffff) ^ table[((crc >> 16) ^ byte) & 0xff]
+    return crc | 0xFF000000
@@ -1,12 +1,63 @@
 #!/usr/bin/python3
 #-*- coding: utf-8 -*-
 
+import array
+import mmap
 import struct
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from blendersims2.fileio import qfs
+
+# NumPy equivalents of the struct/array typecodes used for bulk reads; packed data is always little-endian
+NumpyTypes = {'B': '<u1', 'H': '<u2', 'I': '<u4', 'f': '<f4'}
+
+# Precompiled struct.Structs, so reading a field doesn't mean formatting and looking up a format string
+Structs = {}
+ArrayStructs = {}
+
+def GetStruct(fmt):
+    """Little-endian struct.Struct for fmt, compiled the first time it's asked for"""
+    packer = Structs.get(fmt)
+    if packer is None:
+        packer = Structs[fmt] = struct.Struct('<' + fmt)
+    return packer
+
+def GetArrayStruct(typecode, num):
+    """struct.Struct for num values of typecode"""
+    packer = ArrayStructs.get((typecode, num))
+    if packer is None:
+        packer = ArrayStructs[(typecode, num)] = GetStruct('%d%s' % (num, typecode))
+    return packer
+
+BYTE = GetStruct('B')
+WORD = GetStruct('H')
+UINT24 = GetStruct('3B')        # Big-endian, so assembled by hand
+DWORD = GetStruct('I')
+FLOAT = GetStruct('f')
+VEC3 = GetStruct('3f')
+QUAT = GetStruct('4f')
+TRANSFORM = GetStruct('7f')     # Translation then rotation quaternion
+CHAIN = GetStruct('BBI')        # Enabled and subnode bools, then node index
+
 class DataGenerator:
-    
-    def __init__(self, fh, offset=None, size=None, decompressed_size=None, verbose=False):
+    """Reads fields from a packed file, which may or may not be compressed. fh can be an ordinary file handle or an
+       mmap; for an mmap, and for decompressed data, reads are served as zero-copy slices of an in-memory buffer.
+       With stream set, compressed data is instead decompressed as reads reach it, keeping only a bounded window in
+       memory; reads then return copies, and can't go back further than the window."""
+
+    def __init__(self, fh, offset=None, size=None, decompressed_size=None, verbose=False, cache=None, cache_key=None,
+                 stream=False):
         self.fh = fh
+        self.buffer = None
+        self.stream = None
+        self.ptr = 0
+        self.offset = offset if offset else 0
+        if isinstance(fh, mmap.mmap):
+            self.buffer = memoryview(fh)
         if offset:
             if verbose:
                 print("Going to offset %d" % offset)
@@ -15,135 +66,171 @@ class DataGenerator:
         self.decompressed = False    # Initially read raw data whatever
         self.decompressed_size = decompressed_size
         if self.decompressed_size:
-            self.decompress()
-    
-    def decompress(self, verbose=False):
+            # A PayloadCache lets repeated reads of the same compressed resource skip decompression
+            payload = cache.get(cache_key) if cache is not None else None
+            if payload is None and stream:
+                # Whole payloads aren't kept when streaming, so there's nothing to put in the cache
+                self.decompress(stream=True)
+            elif payload is None:
+                self.decompress()
+                if cache is not None:
+                    cache.put(cache_key, self.decomp_buffer)
+            else:
+                self.set_decompressed(payload)
+
+    def decompress(self, verbose=False, stream=False):
         # Read header and sanity check
         compsize = self.get_dword()
         if compsize != self.size:
             raise ValueError("Compressed size in header (%d) does not match expected value from Index (%d)" % (compsize, self.size))
         comp_id = self.get_word()
-        if comp_id != 0xfb10:
+        if comp_id != qfs.QFS_ID:
             raise ValueError("Invalid expression ID: expected 0xfb10, got %d" % comp_id)
         decompsize = self.get_uint24()
         if decompsize != self.decompressed_size:
             print("Decompressed size in header (%d) does not match expected value from directory (%d)" % (decompsize, self.decompressed_size))
             #raise ValueError("Decompressed size in header (%d) does not match expected value from directory (%d)" % (decompsize, self.decompressed_size))
-        
-        # Initialise a byte array and a write pointer
+
+        # Read the whole compressed payload in one go and hand it to the QFS decompressor
+        data = self.read(compsize - qfs.QFS_HEADER_SIZE)
+        if stream:
+            if verbose:
+                print("Streaming decompressed data, size %d" % decompsize)
+            # The stream outlives this call, so copy rather than keep a view that would stop the package's mmap closing
+            self.stream = qfs.StreamDecompressor(bytes(data), decompsize)
+            self.decompressed = True
+            self.buffer = None
+            self.ptr = 0
+            return
         if verbose:
             print("Creating buffer for decompressed data, size %d" % decompsize)
-        self.decomp_buffer = bytearray(decompsize)
-        wptr = 0
-        
-        # Now iterate through the compressed data until the buffer is full
-        while wptr < decompsize:
-            byte0 = self.get_byte()
-            if byte0 < 0x80:
-                byte1 = self.get_byte()
-                num_plain_text = (byte0 & 0x03)
-                num_to_copy = ((byte0 & 0x1c) >> 2) + 3
-                copy_offset = ((byte0 & 0x60) << 3) + byte1 + 1
-            elif byte0 < 0xc0:
-                byte1 = self.get_byte()
-                byte2 = self.get_byte()
-                num_plain_text = ((byte1 & 0xc0) >> 6)
-                num_to_copy = (byte0 & 0x3f) + 4
-                copy_offset = ((byte1 & 0x3f) << 8) + byte2 + 1
-            elif byte0 < 0xe0:
-                byte1 = self.get_byte()
-                byte2 = self.get_byte()
-                byte3 = self.get_byte()
-                num_plain_text = (byte0 & 0x03)
-                num_to_copy = ((byte0 & 0x0C) << 6) + byte3 + 5
-                copy_offset = ((byte0 & 0x10) << 12) + (byte1 << 8) + byte2 + 1
-            elif byte0 < 0xfd:
-                num_plain_text = ((byte0 & 0x1F) << 2) + 4
-                num_to_copy = 0
-                copy_offset = None
-            else:
-                num_plain_text = (byte0 & 0x03)
-                num_to_copy = 0
-                copy_offset = None
-        
-            if verbose:
-                print("Num plain text = %d" % num_plain_text, end='')
-                if num_to_copy > 0:
-                    print(", num to copy = %d, copy offset = %d" % (num_to_copy, copy_offset))
-                else:
-                    print()
-    
-            # Copy plain text from input stream
-            self.decomp_buffer[wptr:(wptr + num_plain_text - 1)] = self.get_bytes(num_plain_text)
-            wptr += num_plain_text
-            # Copy from earlier in buffer. Need to do this with a loop because the input and output could overlap
-            if num_to_copy > 0:
-                rptr = wptr - copy_offset
-                for _ in range(0, num_to_copy):
-                    if verbose:
-                        print("wptr = %d, rptr = %d" % (wptr, rptr))
-                    self.decomp_buffer[wptr] = self.decomp_buffer[rptr]
-                    wptr += 1
-                    rptr += 1
-            if verbose:
-                print(repr(self.decomp_buffer))
-            
-        # Sanity check!
-        if wptr != decompsize:
-            raise ValueError("Decompressed larger than expected!")
-        
-        # Finally set a flag to say we've decompressed and a pointer to the start of the byte array
+        self.set_decompressed(qfs.decompress(data, decompsize, verbose))
+
+    def set_decompressed(self, payload):
+        # Set a flag to say we've decompressed and serve further reads from the byte array
+        self.decomp_buffer = payload
         self.decompressed = True
-        self.decomp_ptr = 0
+        self.buffer = memoryview(payload)
+        self.stream = None
+        self.ptr = 0
+
+    def detach(self):
+        """Read the rest of an uncompressed packed file into memory, so later reads don't depend on the file handle
+           still being open or positioned where we left it. Offsets are then relative to where we were. From an mmap
+           the rest is copied, so a long-lived reader doesn't keep the whole mapping open. A stream is decompressed in
+           full instead, which it can only be before anything has been released."""
+        if self.stream is not None:
+            ptr = self.ptr
+            self.set_decompressed(self.stream.finish())
+            self.ptr = ptr
+        elif self.buffer is not None and not self.decompressed:
+            self.buffer = memoryview(bytes(self.buffer[self.ptr:(self.offset + self.size)]))
+            self.ptr = 0
+            self.fh = None
+        elif self.buffer is None:
+            self.buffer = memoryview(self.fh.read(self.size))
+            self.ptr = 0
+            self.fh = None
 
     def goto(self, offset):
-        self.fh.seek(offset)
-        
+        if self.buffer is not None or self.stream is not None:
+            self.ptr = offset
+        else:
+            self.fh.seek(offset)
+
     def read(self, n):
-        if self.decompressed:
-            res = self.decomp_buffer[self.decomp_ptr:(self.decomp_ptr + n)]
-            self.decomp_ptr += n
+        if self.buffer is not None:
+            res = self.buffer[self.ptr:(self.ptr + n)]
+            self.ptr += n
+        elif self.stream is not None:
+            res = self.stream.read(self.ptr, n)
+            self.ptr += n
         else:
             res = self.fh.read(n)
         return res
-        
+
+    def unpack_struct(self, packer):
+        """Unpack a record with the precompiled struct.Struct packer"""
+        if self.buffer is not None:
+            res = packer.unpack_from(self.buffer, self.ptr)
+            self.ptr += packer.size
+        elif self.stream is not None:
+            res = packer.unpack(self.read(packer.size))
+        else:
+            res = packer.unpack(self.fh.read(packer.size))
+        return res
+
     def get_byte(self, verbose=False):
-        res = struct.unpack('B', self.read(1))[0]
+        res = self.unpack_struct(BYTE)[0]
         if verbose:
             print(format(res, '#04x'))
         return res
-    
+
     def get_bytes(self, num):
-        return struct.unpack('%dB' % num, self.read(num))
-    
+        return self.unpack_struct(GetArrayStruct('B', num))
+
     def get_string(self, num):
-        return struct.unpack('%ds' % num, self.read(num))[0].decode('ascii')
-                      
+        return str(self.read(num), 'ascii')
+
     def get_word(self):
-        return struct.unpack('H', self.read(2))[0]
+        return self.unpack_struct(WORD)[0]
 
     def get_words(self, num):
-        return struct.unpack('%dH' % num, self.read(2*num))
-    
+        return self.unpack_struct(GetArrayStruct('H', num))
+
     def get_uint24(self):
-        data = struct.unpack('3B', self.read(3))
+        data = self.unpack_struct(UINT24)
         return data[0]*256*256 + data[1]*256 + data[2]
-    
+
     def get_dword(self):
-        return struct.unpack('I', self.read(4))[0]
-        
+        return self.unpack_struct(DWORD)[0]
+
     def get_dwords(self, num):
-        return struct.unpack('%dI' % num, self.read(4*num))
+        return self.unpack_struct(GetArrayStruct('I', num))
 
     def get_float(self):
-        return struct.unpack('f', self.read(4))[0]
-        
+        return self.unpack_struct(FLOAT)[0]
+
     def get_floats(self, num):
-        return struct.unpack('%df' % num, self.read(4*num))
-    
+        return self.unpack_struct(GetArrayStruct('f', num))
+
+    def get_vec3(self):
+        """(x, y, z) floats"""
+        return self.unpack_struct(VEC3)
+
+    def get_quat(self):
+        """(x, y, z, w) floats"""
+        return self.unpack_struct(QUAT)
+
+    def get_transform(self):
+        """A translation followed by a rotation, as (x, y, z) and (x, y, z, w)"""
+        values = self.unpack_struct(TRANSFORM)
+        return values[:3], values[3:]
+
+    def get_chain(self):
+        """(enabled, subnode, node): two bools and a DWORD"""
+        enabled, subnode, node = self.unpack_struct(CHAIN)
+        if enabled > 1 or subnode > 1:
+            raise ValueError("Expected bool, got %s" % format(enabled if enabled > 1 else subnode, '#04x'))
+        return enabled == 1, subnode == 1, node
+
+    def get_array(self, typecode, num, shape=None):
+        """Read num values of typecode ('B', 'H', 'I' or 'f') in one go. Returns a NumPy array, reshaped to shape if
+           given, when NumPy is available (as it is in Blender), otherwise a flat array.array."""
+        data = self.read(num * struct.calcsize(typecode))
+        if numpy is not None:
+            # Copy so the array owns its memory rather than holding a view of the package or payload
+            res = numpy.frombuffer(data, dtype=NumpyTypes[typecode], count=num).copy()
+            if shape:
+                res = res.reshape(shape)
+        else:
+            res = array.array(typecode)
+            res.frombytes(data)
+        return res
+
     def tell(self):
-        if self.decompressed:
-            res = self.decomp_ptr
+        if self.buffer is not None or self.stream is not None:
+            res = self.ptr
         else:
             res = self.fh.tell()
         return res
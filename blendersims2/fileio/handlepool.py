@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+import collections
+import mmap
+
+class FileHandlePool:
+    """Bounded LRU pool of open read handles, shared by all the DBPFs belonging to a PackageManager so that repeated
+       lookups in the same package don't reopen it. Handles stay open until evicted or the pool is closed. With
+       use_mmap the pool hands out read-only mmaps, which DataGenerator reads from without copying."""
+
+    def __init__(self, max_handles=64, use_mmap=False):
+        self.max_handles = max_handles
+        self.use_mmap = use_mmap
+        self.handles = collections.OrderedDict()
+        self.opens = 0
+        self.hits = 0
+        self.pinned = []    # mmaps that couldn't be closed because something still had a view of them
+
+    def get(self, path):
+        fh = self.handles.get(path)
+        if fh is not None:
+            self.handles.move_to_end(path)
+            self.hits += 1
+            return fh
+        fh = self.open(path)
+        self.opens += 1
+        self.handles[path] = fh
+        while len(self.handles) > self.max_handles:
+            oldest_path, oldest = self.handles.popitem(last=False)
+            self.close_handle(oldest_path, oldest)
+        return fh
+
+    def open(self, path):
+        fh = open(path, 'rb')
+        if self.use_mmap:
+            try:
+                mapping = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can't be mapped
+                return fh
+            fh.close()
+            return mapping
+        return fh
+
+    def close_handle(self, path, fh):
+        """Close a handle. An mmap that something still has a view of can't be unmapped yet (and on Windows keeps the
+           file locked), so it's reported and kept to be closed again later."""
+        try:
+            fh.close()
+        except BufferError:
+            print("Can't unmap %s yet, it's still in use" % path)
+            self.pinned.append((path, fh))
+
+    def close_pinned(self):
+        """Try again to close the mmaps which were still in use, returning how many still are"""
+        pinned = self.pinned
+        self.pinned = []
+        for path, fh in pinned:
+            self.close_handle(path, fh)
+        return len(self.pinned)
+
+    def release(self, path):
+        fh = self.handles.pop(path, None)
+        if fh is not None:
+            self.close_handle(path, fh)
+
+    def close(self):
+        self.close_pinned()
+        while self.handles:
+            path, fh = self.handles.popitem()
+            self.close_handle(path, fh)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+import os
+import struct
+
+from blendersims2.fileio.tgir import DescriptorFromBytes, DescriptorToBytes
+from blendersims2.fileio.version import Version
+
+def DefaultIndexCachePath():
+    return os.path.join(os.path.expanduser('~'), '.blendersims2', 'dbpfindex.cache')
+
+class IndexCache:
+    """Versioned on-disk cache of DBPF indices, keyed by package path, size and modification time. Records are only
+       decoded when the package they describe is looked up, so loading the cache is a single read. Namemaps built
+       for packages without an NMAP are kept alongside their index, as is the raw CLST."""
+
+    MAGIC = b'BS2I'
+    VERSION = 3
+
+    FileHeader = struct.Struct('<4sII')         # Magic, version, record count
+    RecordHeader = struct.Struct('<HQQ')        # Path length, size, mtime_ns (path follows)
+    RecordBody = struct.Struct('<7I3I4I')       # Versions, entry count, index offset/size, CLST offset/size/present, NMAP count, index count, namemap bytes, CLST bytes
+    Location = struct.Struct('<16sII')          # Descriptor, offset, size
+    NamemapHeader = struct.Struct('<II')        # RCOL type, entry count
+    NamemapEntry = struct.Struct('<BH')         # Descriptor length, name length (descriptor and name follow)
+
+    def __init__(self, path=None, verbose=False):
+        self.path = path if path else DefaultIndexCachePath()
+        self.records = {}    # Package path -> (size, mtime_ns, record) where record is encoded bytes
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.load(verbose)
+
+    def load(self, verbose=False):
+        self.records = {}
+        try:
+            with open(self.path, 'rb') as fh:
+                data = fh.read()
+        except OSError:
+            if verbose:
+                print("No index cache at %s" % self.path)
+            return
+        try:
+            magic, version, count = self.FileHeader.unpack_from(data, 0)
+            if magic != self.MAGIC or version != self.VERSION:
+                print("Ignoring index cache %s, unrecognised format or version" % self.path)
+                return
+            view = memoryview(data)
+            ptr = self.FileHeader.size
+            for _ in range(count):
+                pathlen, size, mtime_ns = self.RecordHeader.unpack_from(data, ptr)
+                ptr += self.RecordHeader.size
+                path = bytes(view[ptr:(ptr + pathlen)]).decode('utf-8')
+                ptr += pathlen
+                start = ptr
+                body = self.RecordBody.unpack_from(data, ptr)
+                ptr += self.RecordBody.size + (body[10] + body[11]) * self.Location.size + body[12] + body[13]
+                if ptr > len(data):
+                    raise ValueError("Record for %s runs past the end of the file" % path)
+                self.records[path] = (size, mtime_ns, view[start:ptr])
+        except (struct.error, ValueError) as err:
+            print("Index cache %s is corrupt, ignoring it: %s" % (self.path, err))
+            self.records = {}
+            return
+        if verbose:
+            print("Loaded index cache %s with %d packages" % (self.path, len(self.records)))
+
+    def save(self, verbose=False):
+        if not self.dirty:
+            return
+        chunks = [self.FileHeader.pack(self.MAGIC, self.VERSION, len(self.records))]
+        for path, (size, mtime_ns, record) in self.records.items():
+            encoded_path = path.encode('utf-8')
+            chunks.append(self.RecordHeader.pack(len(encoded_path), size, mtime_ns))
+            chunks.append(encoded_path)
+            chunks.append(record)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as fh:
+            fh.write(b''.join(chunks))
+        os.replace(tmp, self.path)
+        self.dirty = False
+        if verbose:
+            print("Saved index cache %s with %d packages" % (self.path, len(self.records)))
+
+    def prune(self, keep):
+        """Drop records for packages that aren't in keep, e.g. because they've been deleted"""
+        for path in [path for path in self.records if path not in keep]:
+            del self.records[path]
+            self.dirty = True
+
+    def lookup(self, package, file, stat):
+        """Fill in the index of DBPF package from the cache. Returns False if there's no up to date record."""
+        record = self.records.get(file)
+        if not record or record[0] != stat.st_size or record[1] != stat.st_mtime_ns:
+            self.misses += 1
+            return False
+        data = record[2]
+        body = self.RecordBody.unpack_from(data, 0)
+        package.file = file
+        package.ver = Version(body[0], body[1])
+        package.indexver = Version(body[2], body[3])
+        package.indexentrycount = body[4]
+        package.indexoffset = body[5]
+        package.indexsize = body[6]
+        package.dircomp_location = (body[7], body[8]) if body[9] else None
+        package.dircomp = None
+        package.namemaps = None
+        ptr = self.RecordBody.size
+        nmap_end = ptr + body[10] * self.Location.size
+        index_end = nmap_end + body[11] * self.Location.size
+        namemaps_end = index_end + body[12]
+        package.dircomp_data = bytes(data[namemaps_end:(namemaps_end + body[13])]) if body[13] else None
+        # Descriptors are stored packed, as in the package, and read back as ints
+        from_bytes = int.from_bytes
+        package.namemap_locations = [(from_bytes(descriptor, 'little'), offset, size)
+                                     for descriptor, offset, size in self.Location.iter_unpack(data[ptr:nmap_end])]
+        ver = package.indexver
+        package.index = {from_bytes(descriptor, 'little'): (offset, size, ver)
+                         for descriptor, offset, size in self.Location.iter_unpack(data[nmap_end:index_end])}
+        if body[12]:
+            package.namemaps = self.decode_namemaps(data[index_end:namemaps_end])
+            package.generated_namemaps = True
+        self.hits += 1
+        return True
+
+    def store(self, package, file, stat):
+        self.records[file] = (stat.st_size, stat.st_mtime_ns, self.encode(package))
+        self.dirty = True
+
+    def store_namemaps(self, package):
+        """Add the namemaps just built for package to its record, if it has one"""
+        record = self.records.get(package.file)
+        if not record:
+            return False
+        self.records[package.file] = (record[0], record[1], self.encode(package))
+        self.dirty = True
+        return True
+
+    def encode(self, package):
+        namemaps = self.encode_namemaps(package.namemaps) if package.generated_namemaps and package.namemaps else b''
+        clst = package.dircomp_data if package.dircomp_data is not None else b''
+        if package.dircomp_location:
+            dircomp = (package.dircomp_location[0], package.dircomp_location[1], 1)
+        else:
+            dircomp = (0, 0, 0)
+        chunks = [self.RecordBody.pack(package.ver.major, package.ver.minor, package.indexver.major, package.indexver.minor,
+                                       package.indexentrycount, package.indexoffset, package.indexsize, dircomp[0], dircomp[1],
+                                       dircomp[2], len(package.namemap_locations), len(package.index), len(namemaps),
+                                       len(clst))]
+        chunks.extend(self.Location.pack(DescriptorToBytes(descriptor), offset, size)
+                      for descriptor, offset, size in package.namemap_locations)
+        chunks.extend(self.Location.pack(DescriptorToBytes(descriptor), offset, size)
+                      for descriptor, (offset, size, _) in package.index.items())
+        chunks.append(namemaps)
+        chunks.append(clst)
+        return b''.join(chunks)
+
+    def encode_namemaps(self, namemaps):
+        chunks = []
+        for rcol_type, namemap in namemaps.items():
+            chunks.append(self.NamemapHeader.pack(int(rcol_type), len(namemap)))
+            for name, descriptor in namemap.items():
+                encoded_name = name.encode('utf-8')
+                chunks.append(self.NamemapEntry.pack(16, len(encoded_name)))
+                chunks.append(DescriptorToBytes(descriptor))
+                chunks.append(encoded_name)
+        return b''.join(chunks)
+
+    def decode_namemaps(self, data):
+        namemaps = {}
+        ptr = 0
+        while ptr < len(data):
+            rcol_type, count = self.NamemapHeader.unpack_from(data, ptr)
+            ptr += self.NamemapHeader.size
+            namemap = {}
+            for _ in range(count):
+                desclen, namelen = self.NamemapEntry.unpack_from(data, ptr)
+                ptr += self.NamemapEntry.size
+                descriptor = DescriptorFromBytes(bytes(data[ptr:(ptr + desclen)]))
+                ptr += desclen
+                namemap[bytes(data[ptr:(ptr + namelen)]).decode('utf-8')] = descriptor
+                ptr += namelen
+            namemaps[rcol_type] = namemap
+        return namemaps
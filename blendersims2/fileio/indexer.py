@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+import threading
+import time
+
+class BackgroundIndexer:
+    """Reads a PackageManager's package indices on a background thread, so a UI can stay responsive and show progress
+       while a large install is loaded. If the manager already has packages, refreshes it instead, which only reads
+       what has changed. The manager shouldn't be used by anything else until finished is set. Works just as well
+       without Blender, polling progress() or calling wait()."""
+
+    def __init__(self, packman, extract_namemaps=False, workers=None, use_processes=False, verbose=False):
+        self.packman = packman
+        self.extract_namemaps = extract_namemaps
+        self.workers = workers
+        self.use_processes = use_processes
+        self.verbose = verbose
+        self.cancel_event = threading.Event()
+        self.finished = threading.Event()
+        self.lock = threading.Lock()
+        self.done = 0
+        self.total = 0
+        self.bytes_read = 0
+        self.started_at = None
+        self.elapsed = 0.0
+        self.cancelled = False
+        self.error = None
+        self.result = None
+        self.thread = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self.thread = threading.Thread(target=self.run, name="blendersims2 indexer", daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        try:
+            if self.packman.packages:
+                self.result = self.packman.Refresh(self.extract_namemaps, self.verbose, self.workers, self.use_processes,
+                                                   self.update, self.cancel_event)
+                self.cancelled = self.result is None
+            else:
+                self.result = self.packman.ReadDBPFIndices(self.extract_namemaps, self.verbose, None, self.workers,
+                                                           self.use_processes, self.update, self.cancel_event)
+                self.cancelled = not self.result
+        except Exception as err:
+            print("Background indexing failed: %s" % err)
+            self.error = err
+        self.elapsed = time.perf_counter() - self.started_at
+        self.finished.set()
+
+    def update(self, done, total, bytes_read):
+        """Progress callback passed to the package manager"""
+        with self.lock:
+            self.done = done
+            self.total = total
+            self.bytes_read = bytes_read
+
+    def progress(self):
+        """(packages done, total packages, bytes read) so far"""
+        with self.lock:
+            return self.done, self.total, self.bytes_read
+
+    def fraction(self):
+        done, total, _ = self.progress()
+        return done / total if total else 0.0
+
+    def cancel(self):
+        """Ask the indexer to stop; the manager is left as it was before it started"""
+        self.cancel_event.set()
+
+    def wait(self, timeout=None):
+        """Wait for the indexer to finish. Returns False on timeout."""
+        return self.finished.wait(timeout)
+
+    def is_running(self):
+        return self.thread is not None and not self.finished.is_set()
+
+    def succeeded(self):
+        return self.finished.is_set() and not self.cancelled and self.error is None
+
+    def __str__(self):
+        done, total, bytes_read = self.progress()
+        if self.cancelled:
+            state = "cancelled"
+        elif self.error is not None:
+            state = "failed"
+        elif self.finished.is_set():
+            state = "finished"
+        else:
+            state = "running"
+        return "%s: %d/%d packages, %.1fMB read" % (state, done, total, bytes_read / 1e6)
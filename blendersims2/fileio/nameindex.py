@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+import array
+import collections
+
+from blendersims2.fileio.crcutils import sims2crc32, sims2crc32_many
+from blendersims2.fileio.tgir import MakeDescriptor, SplitDescriptor
+
+class NameIndex:
+    """Global index of RCOL names across all packages, replacing a dict of name -> descriptor per type. Entries are
+       keyed by the RCOL type and the Sims 2 CRC32 of the lowercased name, and held in parallel integer arrays with
+       the names packed into one byte string, so hash collisions can be checked against the name actually stored.
+       Keys are found through an open addressing table of entry positions, so there are no per-name Python objects.
+       Entries can be added a package at a time; later entries for the same name override earlier ones, just as
+       later packages override earlier ones in the package index. Each entry records its owner, normally the package
+       it came from: owners can be given ranks, which take precedence over the order entries were added in, and can
+       be removed, which hides their entries, so packages can be added and dropped without rebuilding the index.
+       Hidden entries are dropped for good once they make up more than COMPACT_SHARE of the index."""
+
+    INITIAL_BITS = 10
+    COMPACT_SHARE = 0.25
+
+    def __init__(self):
+        self.bits = self.INITIAL_BITS
+        self.slots = array.array('i', [-1]) * (1 << self.bits)    # Most recently added entry for each key, or -1
+        self.keys = 0                       # Number of slots in use
+        self.chain = array.array('i')       # Position of previous entry with the same key, or -1
+        self.crcs = array.array('I')
+        self.types = array.array('I')       # Key type, normally the same as the descriptor's
+        self.descriptor_types = array.array('I')
+        self.groups = array.array('I')
+        self.instances = array.array('I')
+        self.resources = array.array('I')
+        self.name_offsets = array.array('I')
+        self.name_lengths = array.array('H')
+        self.names = bytearray()
+        self.owners = array.array('I')
+        self.ranks = {}                     # Owner -> rank, 0 if not set, -1 if removed
+        self.type_counts = collections.Counter()    # Live entries of each key type
+        self.owner_counts = collections.defaultdict(collections.Counter)    # Owner -> live entries of each key type
+        self.dead = 0                       # Entries hidden by remove_owner but not yet compacted away
+
+    def add(self, rcol_type, name, descriptor, crc=None, owner=0):
+        encoded = name.lower().encode('ascii')
+        if crc is None:
+            crc = sims2crc32(encoded)
+        rcol_type = int(rcol_type)
+        slot = self.find_slot(rcol_type, crc)
+        position = len(self.chain)
+        head = self.slots[slot]
+        self.chain.append(head)
+        self.slots[slot] = position
+        values = SplitDescriptor(descriptor)
+        self.resources.append(values[3])
+        self.crcs.append(crc)
+        self.types.append(rcol_type)
+        self.descriptor_types.append(values[0])
+        self.groups.append(values[1])
+        self.instances.append(values[2])
+        self.name_offsets.append(len(self.names))
+        self.name_lengths.append(len(encoded))
+        self.names += encoded
+        self.owners.append(owner)
+        self.type_counts[rcol_type] += 1
+        self.owner_counts[owner][rcol_type] += 1
+        if head < 0:
+            self.keys += 1
+            if self.keys * 2 > len(self.slots):
+                self.grow()
+
+    def find_slot(self, rcol_type, crc):
+        """The slot for a key: either the one holding it or the empty one where it would go"""
+        slots = self.slots
+        mask = len(slots) - 1
+        # CRCs of similar names share bit patterns, so scramble before taking the top bits (Fibonacci hashing)
+        slot = (((crc ^ rcol_type) * 0x9E3779B1) & 0xffffffff) >> (32 - self.bits)
+        while True:
+            position = slots[slot]
+            if position < 0 or (self.crcs[position] == crc and self.types[position] == rcol_type):
+                return slot
+            slot = (slot + 1) & mask
+
+    def grow(self):
+        heads = [position for position in self.slots if position >= 0]
+        self.bits += 1
+        self.slots = array.array('i', [-1]) * (1 << self.bits)
+        for position in heads:
+            self.slots[self.find_slot(self.types[position], self.crcs[position])] = position
+
+    def add_namemap(self, rcol_type, namemap, owner=0):
+        names = list(namemap)
+        crcs = sims2crc32_many(names)
+        for name, crc in zip(names, crcs):
+            self.add(rcol_type, name, namemap[name], crc, owner)
+
+    def add_package(self, package, owner=0):
+        if package.namemaps:
+            for rcol_type, namemap in package.namemaps.items():
+                self.add_namemap(rcol_type, namemap, owner)
+
+    def set_rank(self, owner, rank):
+        self.ranks[owner] = rank
+
+    def remove_owner(self, owner):
+        """Hide all the entries added for owner, compacting the index if enough are hidden"""
+        if self.ranks.get(owner, 0) < 0:
+            return
+        self.ranks[owner] = -1
+        # The entries themselves are hidden by the rank, so only the counts need updating
+        counts = self.owner_counts.pop(owner, {})
+        self.type_counts.subtract(counts)
+        self.dead += sum(counts.values())
+        if self.dead > len(self.chain) * self.COMPACT_SHARE:
+            self.compact()
+
+    def compact(self):
+        """Drop the hidden entries, rebuilding the arrays and key table from the live ones in the order they were
+           added"""
+        ranks = self.ranks
+        live = [position for position, owner in enumerate(self.owners) if ranks.get(owner, 0) >= 0]
+        old = (self.crcs, self.types, self.descriptor_types, self.groups, self.instances, self.resources, self.owners)
+        new = tuple(array.array(column.typecode, (column[position] for position in live)) for column in old)
+        (self.crcs, self.types, self.descriptor_types, self.groups, self.instances, self.resources, self.owners) = new
+        names = bytearray()
+        name_offsets = array.array('I')
+        name_lengths = array.array('H')
+        for position in live:
+            offset = self.name_offsets[position]
+            length = self.name_lengths[position]
+            name_offsets.append(len(names))
+            name_lengths.append(length)
+            names += self.names[offset:(offset + length)]
+        self.names, self.name_offsets, self.name_lengths = names, name_offsets, name_lengths
+        # The removed owners have no entries left
+        self.ranks = {owner: rank for owner, rank in ranks.items() if rank >= 0}
+        self.dead = 0
+
+        self.bits = self.INITIAL_BITS
+        while len(live) * 2 > (1 << self.bits):
+            self.bits += 1
+        self.slots = array.array('i', [-1]) * (1 << self.bits)
+        self.chain = array.array('i', [-1]) * len(live)
+        self.keys = 0
+        for position in range(len(live)):
+            slot = self.find_slot(self.types[position], self.crcs[position])
+            head = self.slots[slot]
+            if head < 0:
+                self.keys += 1
+            self.chain[position] = head
+            self.slots[slot] = position
+
+    def matches(self, rcol_type, name):
+        """(rank, position) of the live entries for name, most recently added first"""
+        encoded = name.lower().encode('ascii')
+        position = self.slots[self.find_slot(int(rcol_type), sims2crc32(encoded))]
+        ranks = self.ranks
+        res = []
+        while position >= 0:
+            offset = self.name_offsets[position]
+            if self.name_lengths[position] == len(encoded) and self.names[offset:(offset + len(encoded))] == encoded:
+                rank = ranks.get(self.owners[position], 0)
+                if rank >= 0:
+                    res.append((rank, position))
+            position = self.chain[position]
+        return res
+
+    def get_descriptor(self, position):
+        return MakeDescriptor(self.descriptor_types[position], self.groups[position], self.instances[position],
+                              self.resources[position])
+
+    def get_name(self, position):
+        offset = self.name_offsets[position]
+        return self.names[offset:(offset + self.name_lengths[position])].decode('ascii')
+
+    def candidates(self, rcol_type, name):
+        """Descriptors for name, highest ranked first, then most recently added first"""
+        matches = self.matches(rcol_type, name)
+        matches.sort(key=lambda match: -match[0])
+        return [self.get_descriptor(position) for _, position in matches]
+
+    def find(self, rcol_type, name):
+        """The descriptor for name, or None"""
+        best = None
+        for rank, position in self.matches(rcol_type, name):
+            if best is None or rank > best[0]:
+                best = (rank, position)
+        return self.get_descriptor(best[1]) if best else None
+
+    def has_type(self, rcol_type):
+        return self.type_counts[int(rcol_type)] > 0
+
+    def clear(self):
+        self.__init__()
+
+    def __len__(self):
+        return len(self.chain) - self.dead
+
+    def __str__(self):
+        return "%d names, %d distinct keys, %d bytes of names, %d hidden" % (len(self), self.keys, len(self.names),
+                                                                             self.dead)
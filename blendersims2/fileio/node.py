@@ -66,7 +66,7 @@ class cObjectGraphNode(Node):
         if verbose:
             print ("Extension count: %d" % count)
         for _ in range (0, count):
-            self.extensions.append(Chain(dg, True))
+            self.extensions.append(Chain(dg))
             
         # Optional resource name
         if self.version == 4:
@@ -104,7 +104,7 @@ class cTransformNode(Node):
         
         # Some nodes
         self.comptreenode = cCompositionTreeNode(dg, verbose)
-        self.objgraphnode = cObjectGraphNode(dg, True) #verbose)
+        self.objgraphnode = cObjectGraphNode(dg, verbose)
     
         # Some chains
         self.chains = []
@@ -112,9 +112,10 @@ class cTransformNode(Node):
         for _ in range (0, count):
             self.chains.append(Chain(dg))
             
-        # Then the transforms
-        self.translation = Translation(dg)
-        self.rotation = Quaternion(dg)
+        # Then the transforms, read in one go
+        translation, rotation = dg.get_transform()
+        self.translation = Translation.from_values(translation)
+        self.rotation = Quaternion.from_values(rotation)
         
         # Finally the "subset"/GMDC joint index
         self.subset = dg.get_dword()
@@ -154,7 +155,7 @@ class cBoneDataExtension(Node):
         super(cBoneDataExtension, self).extract(dg)
         
         # Nodes
-        self.ext = cExtension(dg, verbose=True)
+        self.ext = cExtension(dg, verbose)
 
         # Unknowns
         _ = dg.get_dwords(4)
@@ -3,23 +3,87 @@
 
 import os
 import struct
-import collections
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 #import zlib
 
-from blendersims2.fileio.crcutils import sims2crc32, sims2crc24
+from blendersims2.fileio.crcutils import sims2crc32, sims2crc24, sims2_resource_id
 from blendersims2.fileio.datagenerator import DataGenerator
+from blendersims2.fileio.blockindex import BlockIndex
+from blendersims2.fileio.bloomfilter import BloomFilter
+from blendersims2.fileio.columnindex import ColumnIndex, ColumnPackageIndex, PackageIndexView, PackageDircompView
+from blendersims2.fileio.handlepool import FileHandlePool
+from blendersims2.fileio.indexcache import IndexCache
+from blendersims2.fileio.nameindex import NameIndex
+from blendersims2.fileio.payloadcache import PayloadCache
+from blendersims2.fileio.session import ResolutionSession
+from blendersims2.fileio.typeindex import TypeIndex
 from blendersims2.fileio.version import Version
 from blendersims2.fileio.primitives import Sims2Reader
-from blendersims2.fileio.tgir import Identifier, PackedFile, GetTypeFromDescriptor, GetInstanceFromDescriptor, \
-                 DecodeDescriptor, IndexEntry
+from blendersims2.fileio.tgir import Identifier, PackedFile, PackedFileValues, GetTypeFromDescriptor, \
+                 GetInstanceFromDescriptor, DecodeDescriptor, MakeDescriptor, ToDescriptor, WithoutResource, WithResource
 from blendersims2.fileio.rcol import RCOL
 import blendersims2.fileio.rcol
 
 class DBPF(Sims2Reader):
     """Sims 2 Database-Packed File"""
 
+    # Precompiled index and directory record layouts, by index minor version
+    IndexRecord = {1: struct.Struct('3I2I'), 2: struct.Struct('4I2I')}
+    DirCompRecord = {1: struct.Struct('3II'), 2: struct.Struct('4II')}
+
+    # The CLST as stored in the file, read along with the index and kept in the IndexCache, so the decompressed sizes
+    # can be had without opening the package again
+    dircomp_data = None
+
+    # Shared FileHandlePool and PayloadCache, set by the owning PackageManager
+    handles = None
+    payload_cache = None
+
+    # Whether to parse RCOL data blocks only when they're accessed, also set by the PackageManager
+    lazy_rcols = False
+
+    # Compressed RCOLs at least this big when decompressed are streamed rather than inflated in one go, if set by the
+    # PackageManager
+    stream_threshold = None
+
+    # BlockIndex of RCOL headers and block offsets, if the PackageManager has loaded one
+    block_index = None
+
+    # BloomFilter of the index's descriptors, if the PackageManager has built one
+    bloom_filter = None
+
+    # ID the PackageManager knows the package by, which unlike its position stays the same across a Refresh
+    owner = 0
+
+    # Whether namemaps were built from the RCOLs rather than read from an NMAP, and the IndexCache to keep them in
+    generated_namemaps = False
+    namemap_cache = None
+
+    @contextlib.contextmanager
+    def filehandle(self):
+        """Read handle for the package, borrowed from the shared pool if there is one, otherwise opened just for the
+           duration of the with block"""
+        if self.handles:
+            yield self.handles.get(self.file)
+        else:
+            with open(self.file, 'rb') as fh:
+                yield fh
+
     def extract(self, file, index_only=True, verbose=False):
         self.file = file
+        self.dircomp_location = None
+        self.dircomp = None
+        self.dircomp_data = None
+        self.index = {}
+        self.namemap_locations = []
+        self.namemaps = None
+        # Header fields stay zero if the file turns out not to be a DBPF
+        self.ver = Version(0, 0)
+        self.indexver = Version(0, 0)
+        self.indexentrycount = 0
+        self.indexoffset = 0
+        self.indexsize = 0
         if verbose:
             print("Opening file: %s" % file)
         try:
@@ -48,24 +112,10 @@ class DBPF(Sims2Reader):
                 if verbose:
                     print("Reading DBPF index, which contains %d entries" % self.indexentrycount)
                 fh.seek(self.indexoffset)
-                self.dircomp_location = None
-                self.dircomp = None
-                self.index = {}
-                self.namemap_locations = []
-                self.namemaps = None
-                for _ in range(0, self.indexentrycount):
-                    entry = IndexEntry(self.indexver, fh)
-                    if entry.identifier.type == PackedFile.CLST:
-                        if self.dircomp_location:
-                            raise ValueError("Found more than one directory of compressed files")
-                        else:
-                            self.dircomp_location = (entry.fileoffset, entry.filesize)
-                    else:
-                        descriptor = entry.identifier.get_descriptor()
-                        if entry.identifier.type == PackedFile.NMAP:
-                            self.namemap_locations.append((descriptor, entry.fileoffset, entry.filesize))
-                        else:
-                            self.index[descriptor] = (entry.fileoffset, entry.filesize, entry.identifier.ver)
+                self.extract_index(fh)
+                if self.dircomp_location:
+                    fh.seek(self.dircomp_location[0])
+                    self.dircomp_data = fh.read(self.dircomp_location[1])
 
                 # If a directory of compressed files was found, and we're told to extract it, build up a list of descriptors
                 if not index_only:
@@ -75,6 +125,45 @@ class DBPF(Sims2Reader):
     
         except ValueError as err:
             print("ValueError: \"%s\" in file %s" % (err, file))
+            return False
+        return True
+
+    def extract_index(self, fh):
+        """Read the whole index in one go and decode it without building intermediate objects"""
+        record = self.IndexRecord[self.indexver.minor]
+        data = fh.read(record.size * self.indexentrycount)
+        if len(data) != record.size * self.indexentrycount:
+            raise ValueError("Index is truncated: expected %d entries, file = \"%s\"" % (self.indexentrycount, self.file))
+        ver = self.indexver
+        index = self.index
+        clst = int(PackedFile.CLST)
+        nmap = int(PackedFile.NMAP)
+        if self.indexver.minor == 2:
+            rows = record.iter_unpack(data)
+        else:
+            rows = ((typ, group, instance, 0, offset, size) for typ, group, instance, offset, size in record.iter_unpack(data))
+        for typ, group, instance, resource, offset, size in rows:
+            if typ not in PackedFileValues:
+                raise ValueError("%d is not a valid PackedFile" % typ)
+            if typ == clst:
+                if self.dircomp_location:
+                    raise ValueError("Found more than one directory of compressed files")
+                self.dircomp_location = (offset, size)
+            elif typ == nmap:
+                self.namemap_locations.append((MakeDescriptor(typ, group, instance, resource), offset, size))
+            else:
+                index[typ | (group << 32) | (instance << 64) | (resource << 96)] = (offset, size, ver)
+
+    def get_bytes_read(self, namemaps=False, index=True):
+        """Roughly how many bytes reading the header, index and CLST, and optionally the NMAPs, takes"""
+        total = 0
+        if index:
+            total += 96 + self.indexsize
+            if self.dircomp_location:
+                total += self.dircomp_location[1]
+        if namemaps:
+            total += sum(size for _, _, size in self.namemap_locations)
+        return total
 
     def dump_index(self):
         for descriptor in self.index:
@@ -87,24 +176,27 @@ class DBPF(Sims2Reader):
                 if verbose:
                     print("File contains a directory of compressed files")
                 diroffset, dirsize = self.dircomp_location
-                fh.seek(diroffset)
-                if self.indexver.minor == 2:
-                    records = dirsize // 20
-                    if dirsize % 20 != 0:
-                        raise ValueError("Size of directory of compressed files is not a multiple of 20: got %d, version %s, file = \"%s\"" % (dirsize, str(self.indexver), self.file))
-                else:
-                    records = dirsize // 16
-                    if dirsize % 16 != 0:
-                        raise ValueError("Size of directory of compressed files is not a multiple of 16: got %d, version %s, file = \"%s\"" % (dirsize, str(self.indexver), self.file))
-                for _ in range(0, records):
-                    identifier = Identifier(self.indexver, fh)
-                    descriptor = identifier.get_descriptor()
-                    decompressed_size = struct.unpack('I', fh.read(4))[0]
+                record = self.DirCompRecord[self.indexver.minor]
+                if dirsize % record.size != 0:
+                    raise ValueError("Size of directory of compressed files is not a multiple of %d: got %d, version %s, file = \"%s\"" % (record.size, dirsize, str(self.indexver), self.file))
+                if self.dircomp_data is None:
+                    fh.seek(diroffset)
+                    self.dircomp_data = fh.read(dirsize)
+                data = self.dircomp_data
+                for row in record.iter_unpack(data):
+                    if row[0] not in PackedFileValues:
+                        raise ValueError("%d is not a valid PackedFile" % row[0])
+                    if len(row) == 5:
+                        descriptor = MakeDescriptor(row[0], row[1], row[2], row[3])
+                    else:
+                        descriptor = MakeDescriptor(row[0], row[1], row[2])
                     if verbose:
-                        print("%s -> size %d" % (str(identifier), decompressed_size))
-                    self.dircomp[descriptor] = decompressed_size
+                        print("%s -> size %d" % (str(DecodeDescriptor(descriptor)), row[-1]))
+                    self.dircomp[descriptor] = row[-1]
             return True
         else:
+            if self.dircomp is None:
+                self.dircomp = {}
             return False
 
     def extract_namemaps(self, fh, verbose=False):
@@ -138,7 +230,7 @@ class DBPF(Sims2Reader):
                     # Get name - note unusual DWORD length
                     rcol_namelen = data[2]
                     rcol_name = dg.get_string(rcol_namelen)
-                    rcol_descriptor = struct.pack('3I', nmap_type, rcol_group, rcol_instance)
+                    rcol_descriptor = MakeDescriptor(nmap_type, rcol_group, rcol_instance)
                     new_map[rcol_name] = rcol_descriptor
                     if verbose:
                         print("%s => (%s, %s)" % (rcol_name, hex(rcol_group), hex(rcol_instance)))
@@ -149,7 +241,7 @@ class DBPF(Sims2Reader):
         if verbose:
             print("Constructing namemap for " + self.file)
 
-        with open(self.file, 'rb') as fh:
+        with self.filehandle() as fh:
             self.namemaps = {}
             self.extract_dircomp(fh)
 
@@ -158,12 +250,10 @@ class DBPF(Sims2Reader):
                 if verbose:
                     print("Creating namemap entry for %s" % str(identifier))
 
-                decompressed_size = None
-                if descriptor in self.dircomp:
-                    decompressed_size = self.dircomp[descriptor]
-                dg = DataGenerator(fh, offset, size, decompressed_size)
-
                 if identifier.type.is_rcol():
+                    # get_name only reads the header and the first block's name, so only inflate as far as it reads
+                    decompressed_size = self.dircomp.get(descriptor)
+                    dg = DataGenerator(fh, offset, size, decompressed_size, stream=True)
                     name = RCOL.get_name(dg, identifier).lower()
                     if int(identifier.type) not in self.namemaps:
                         self.namemaps[identifier.type] = {}
@@ -171,26 +261,40 @@ class DBPF(Sims2Reader):
                 else:
                     if verbose:
                         print ("Skipping non-RCOL type %s" % str(identifier.type))
+        self.generated_namemaps = True
 
-    def get_RCOL(self, descriptor, verbose=False):
+    def find_descriptor(self, descriptor):
+        """The descriptor under which a resource is indexed, falling back to a zero resource ID, or None. Asks the
+           Bloom filter first, if there is one."""
+        descriptor = ToDescriptor(descriptor)
+        bloom = self.bloom_filter
+        if (bloom is None or bloom.might_contain(descriptor)) and descriptor in self.index:
+            return descriptor
+        descriptor = WithoutResource(descriptor)
+        if (bloom is None or bloom.might_contain(descriptor)) and descriptor in self.index:
+            return descriptor
+        return None
+
+    def get_RCOL(self, descriptor, verbose=False, lazy=None, use_payload_cache=True):
+        """Read an RCOL. lazy overrides lazy_rcols; lazy RCOLs use the block index's offsets, if there is one.
+           use_payload_cache=False reads around the shared payload cache, for bulk reads that shouldn't evict it."""
+        descriptor = ToDescriptor(descriptor)
+        if lazy is None:
+            lazy = self.lazy_rcols
         decompressed_size = None
         rcol = None
 
-        if descriptor in self.index:
-            (offset, size, _) = self.index[descriptor]
-        else:
-            descriptor = descriptor[0:12] + bytes.fromhex('00000000')
-            if descriptor in self.index:
-                (offset, size, _) = self.index[descriptor]            
-            else:
-                #if verbose:
-                print("Descriptor not found in index: %s" % str(DecodeDescriptor(descriptor)))
-                return rcol
+        found = self.find_descriptor(descriptor)
+        if found is None:
+            #if verbose:
+            print("Descriptor not found in index: %s" % str(DecodeDescriptor(WithoutResource(descriptor))))
+            return rcol
+        descriptor = found
+        (offset, size, _) = self.index[descriptor]
 
-        #if verbose:
-        if True:
+        if verbose:
             print ("Opening " + self.file)
-        with open(self.file, 'rb') as fh:
+        with self.filehandle() as fh:
             self.extract_dircomp(fh)
             if descriptor in self.dircomp:
                 decompressed_size = self.dircomp[descriptor]
@@ -202,7 +306,14 @@ class DBPF(Sims2Reader):
             identifier = DecodeDescriptor(descriptor)
             if verbose:
                 print ("Extracting RCOL")
-            rcol = RCOL(fh, identifier, offset, size, decompressed_size, self, verbose)
+            # Lazy RCOLs need the whole payload for random access, so aren't streamed
+            stream = (not lazy and self.stream_threshold is not None and decompressed_size is not None and
+                      decompressed_size >= self.stream_threshold)
+            payload_cache = self.payload_cache if use_payload_cache else None
+            dg = DataGenerator(fh, offset, size, decompressed_size, verbose, payload_cache, (self.file, descriptor),
+                               stream)
+            offsets = self.block_index.get_offsets(descriptor) if lazy and self.block_index is not None else None
+            rcol = RCOL(identifier=identifier, dbpf=self, verbose=verbose, dg=dg, lazy=lazy, offsets=offsets)
             if verbose:
                 print ("Done!")
         #except ValueError as err:
@@ -216,8 +327,10 @@ class DBPF(Sims2Reader):
             if type(self.namemaps) == None:
                 raise RuntimeError("Namemaps not initialised")
             else:
-                print("No namemap in file %s" % self.file)
-                self.build_namemaps(True)
+                print("No namemap in file %s, building one" % self.file)
+                self.build_namemaps(verbose)
+                if self.namemap_cache is not None:
+                    self.namemap_cache.store_namemaps(self)
         if rcol_type not in self.namemaps:
             print("No local namemap for type %s" % str(rcol_type))
             return None
@@ -234,45 +347,111 @@ class DBPF(Sims2Reader):
             print("Failed to find %s in %s local namemap" % (rcol_name, str(rcol_type)))
             return None
 
+def ReadPackage(file, extract_namemaps=False, package=None):
+    """Read a DBPF's index, or just its namemaps if package has already been loaded from the index cache. Returns the
+       package and whether its index was read from disk. Module level so it can be run in a worker process."""
+    if package:
+        with open(file, 'rb') as fh:
+            package.extract_namemaps(fh)
+        return package, False
+    package = DBPF()
+    read = package.extract(file, index_only=(not extract_namemaps))
+    return package, read
+
+def Fingerprint(stat):
+    """What Refresh compares to tell whether a package has changed"""
+    return (stat.st_size, stat.st_mtime_ns)
+
+def BuildPackageNamemaps(file):
+    """Read a DBPF's index and build namemaps from its RCOLs. Module level so it can be run in a worker process."""
+    package = DBPF()
+    if not package.extract(file):
+        return None
+    package.build_namemaps()
+    return package.namemaps
+
 class PackageManager:
     
-    def __init__(self):
+    def __init__(self, cache_file=None, use_cache=False, max_handles=64, use_mmap=True, max_payload_bytes=256*1024*1024,
+                 lazy_rcols=False, block_index_dir=None, columnar_index=False, use_filters=None, stream_threshold=None):
         self.packages = []
         self.package_index = {}
         self.searchlist = []
+        self.fingerprints = {}    # Package file -> Fingerprint when it was read
+        self.next_owner = 1
+        self.handles = FileHandlePool(max_handles, use_mmap)
+        self.payload_cache = PayloadCache(max_payload_bytes) if max_payload_bytes else None
+        self.session = ResolutionSession()
+        self.lazy_rcols = lazy_rcols
+        self.stream_threshold = stream_threshold
+        self.name_index = NameIndex()
+        self.type_index = TypeIndex()
+        # Optionally keep the merged index in NumPy columns rather than dicts, for very large installs
+        self.column_index = None
+        if columnar_index:
+            try:
+                self.column_index = ColumnIndex()
+            except ImportError as err:
+                print("%s, using the dict index" % err)
+        # Bloom filters only pay for themselves in front of the columnar index; a dict miss is already cheaper
+        self.use_filters = (self.column_index is not None) if use_filters is None else use_filters
+        self.bloom_filter = None
+        self.block_index_dir = block_index_dir
+        self.cache = None
+        if use_cache or cache_file:
+            self.cache = IndexCache(cache_file)
         
+    def NewSession(self):
+        """Forget all memoized RCOLs, e.g. to free memory or pick up changed packages"""
+        self.session = ResolutionSession()
+
+    def close(self):
+        """Close all the package file handles held open for lookups, saving any namemaps built since the index cache
+           was last saved"""
+        self.handles.close()
+        if self.cache:
+            self.cache.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
     def AddDirectory(self, path):
         self.searchlist.append(path)
         
-    def ReadDBPFIndices(self, extract_namemaps=False, verbose=False, alert_identifier=None):
-        packfiles = []
-        
-        # Iterate through directories and get all the .package files
-        for searchdir in self.searchlist:
-            if verbose:
-                print("Searching " + searchdir)
-            for root, _, files in os.walk(searchdir):
-                for file in files:
-                    if file.lower().endswith(".package"):
-                        packfiles.append(os.path.join(root, file))
-        if verbose:
-            print("Found " + str(len(packfiles)) + " .package files")
+    def ReadDBPFIndices(self, extract_namemaps=False, verbose=False, alert_identifier=None, workers=None, use_processes=False,
+                        progress=None, cancel=None):
+        """Read the indices of all packages in the search list. If workers is more than 1 packages are read in a thread
+           pool, or a process pool if use_processes is set (which needs the usual __main__ guard on Windows). Results
+           are always merged in search list order, so later packages override earlier ones just as when reading
+           serially. progress and cancel are as for load_packages; returns False, leaving the manager as it was, if
+           cancelled, otherwise True."""
+        packfiles, stats = self.stat_packfiles(verbose)
             
         # Now iterate through the files and read the DBPFs, building up a hash of parts and a list of CRESs
-        if verbose:
-            typecounts = collections.Counter()
-        self.meta_namemap = {}
+        packages = self.load_packages(packfiles, extract_namemaps, workers, use_processes, stats, progress, cancel)
+        if packages is None:
+            if verbose:
+                print("Reading package indices cancelled")
+            # Keep what was read so far for next time
+            if self.cache:
+                self.cache.save(verbose)
+            return False
         for file in packfiles:
+            self.fingerprints[file] = Fingerprint(stats[file])
+        self.name_index = NameIndex()
+        for file, package in zip(packfiles, packages):
             if verbose:
                 print(file)
-            package = DBPF()
-            package.extract(file, index_only=(not extract_namemaps))
+            self.attach_package(package)
             self.packages.append(package)
+            self.name_index.set_rank(package.owner, len(self.packages) - 1)
             for descriptor in package.index:
-                typ = GetTypeFromDescriptor(descriptor)
-                if verbose:
-                    typecounts[typ] += 1
-                self.package_index[descriptor] = package
+                if self.column_index is None:
+                    self.package_index[descriptor] = package
                 if alert_identifier:
                     if alert_identifier == GetInstanceFromDescriptor(descriptor):
                         print("Found identifier %s, descriptor %s, in file %s \n" % (format(alert_identifier, '#010x'),
@@ -280,49 +459,377 @@ class PackageManager:
                                                                                      file));
             if extract_namemaps:
                 self.extract_namemap(package)
+        if self.column_index is not None:
+            self.build_column_index(verbose)
+        else:
+            self.type_index.build(self.package_index)
+        if self.use_filters:
+            self.build_filters(verbose)
+
+        if self.cache:
+            self.cache.prune(set(packfiles))
+            self.cache.save(verbose)
+            if verbose:
+                print("Index cache: %d packages loaded from cache, %d read from disk" % (self.cache.hits, self.cache.misses))
 
         if verbose:
             total = 0
-            for typename, count in typecounts.items():
-                print(str(count) + " " + str(typename) + "s found")
+            for rtype, count in self.type_index.counts().items():
+                print(str(count) + " " + str(GetTypeFromDescriptor(rtype)) + "s found")
                 total += count
             print ("Total %d RCOLs" % total)
+        return True
+
+    def find_packfiles(self, verbose=False):
+        """All the .package files in the search list, in the order they take precedence (later overrides earlier)"""
+        packfiles = []
+        for searchdir in self.searchlist:
+            if verbose:
+                print("Searching " + searchdir)
+            for root, _, files in os.walk(searchdir):
+                for file in files:
+                    if file.lower().endswith(".package"):
+                        packfiles.append(os.path.join(root, file))
+        if verbose:
+            print("Found " + str(len(packfiles)) + " .package files")
+        return packfiles
+
+    def stat_packfiles(self, verbose=False):
+        """The .package files in the search list, as for find_packfiles, and a dict of their os.stat results. Files
+           deleted before they can be stat'ed are left out, as if they'd never been found."""
+        packfiles = []
+        stats = {}
+        for file in self.find_packfiles(verbose):
+            try:
+                stats[file] = os.stat(file)
+            except OSError:
+                continue
+            packfiles.append(file)
+        return packfiles, stats
+
+    def attach_package(self, package):
+        """Give a newly read package the shared handles and caches, and an owner ID"""
+        package.handles = self.handles
+        package.payload_cache = self.payload_cache
+        package.lazy_rcols = self.lazy_rcols
+        package.stream_threshold = self.stream_threshold
+        package.namemap_cache = self.cache
+        package.owner = self.next_owner
+        self.next_owner += 1
+
+    def Refresh(self, extract_namemaps=False, verbose=False, workers=None, use_processes=False, progress=None,
+                cancel=None):
+        """Pick up packages added to, changed in or removed from the search list since their indices were read, by
+           comparing each file's size and modification time with those recorded then. Only added and changed packages
+           are read, and only the descriptors in them, or in the packages they replace, have their overrides worked
+           out again. Returns the lists of added, changed and removed files, or None (with nothing changed) if
+           cancelled. progress and cancel are as for load_packages."""
+        packfiles, stats = self.stat_packfiles(verbose)
+        added = [file for file in packfiles if file not in self.fingerprints]
+        changed = [file for file in packfiles
+                   if file in self.fingerprints and self.fingerprints[file] != Fingerprint(stats[file])]
+        removed = [file for file in self.fingerprints if file not in stats]
+        if verbose:
+            print("Refresh: %d packages added, %d changed, %d removed" % (len(added), len(changed), len(removed)))
+        if not (added or changed or removed):
+            return added, changed, removed
+
+        # Read the new packages first, so cancelling leaves everything as it was
+        old_packages = {package.file: package for package in self.packages}
+        changed_files = set(changed)
+        fresh_files = [file for file in packfiles if file not in old_packages or file in changed_files]
+        loaded = self.load_packages(fresh_files, extract_namemaps, workers, use_processes, stats, progress, cancel)
+        if loaded is None:
+            if verbose:
+                print("Refresh cancelled")
+            if self.cache:
+                self.cache.save(verbose)
+            return None
+        fresh_packages = dict(zip(fresh_files, loaded))
+
+        # Forget the packages being replaced or removed
+        names_indexed = len(self.name_index) > 0
+        stale = [old_packages[file] for file in changed + removed if file in old_packages]
+        for package in stale:
+            self.handles.release(package.file)
+            if self.payload_cache is not None:
+                self.payload_cache.discard_file(package.file)
+            self.name_index.remove_owner(package.owner)
+        for file in removed:
+            del self.fingerprints[file]
+
+        # Put everything back in search list order
+        for file in fresh_files:
+            self.fingerprints[file] = Fingerprint(stats[file])
+            self.attach_package(fresh_packages[file])
+        self.packages = [fresh_packages[file] if file in fresh_packages else old_packages[file] for file in packfiles]
+        for position, package in enumerate(self.packages):
+            self.name_index.set_rank(package.owner, position)
+        fresh = [fresh_packages[file] for file in fresh_files]
+        if extract_namemaps or names_indexed:
+            # Once there's a name index findname won't rebuild it, so the new packages' names have to go in now
+            for package in fresh:
+                if not package.namemaps:
+                    with package.filehandle() as fh:
+                        package.extract_namemaps(fh)
+                self.extract_namemap(package)
+
+        if self.column_index is not None:
+            # Rebuilding the columns is vectorized, so cheaper than patching them
+            self.build_column_index(verbose)
+        else:
+            affected = self.update_package_index(stale, fresh)
+            self.type_index.update(self.package_index, affected)
+            if verbose:
+                print("Refresh: %d descriptors affected" % len(affected))
+        if self.use_filters:
+            if self.bloom_filter is None or len(self.bloom_filter) + sum(len(package.index) for package in fresh) > \
+                    2 * self.bloom_filter.capacity:
+                self.build_filters(verbose)
+            else:
+                # Stale descriptors stay in the global filter, which only costs the odd false positive
+                for package in fresh:
+                    package.bloom_filter = BloomFilter(len(package.index))
+                    package.bloom_filter.add_many(package.index)
+                    self.bloom_filter.add_many(package.index)
+
+        # Memoized RCOLs may come from, or link to, packages that have gone
+        self.NewSession()
+        if self.cache:
+            self.cache.prune(set(packfiles))
+            self.cache.save(verbose)
+        return added, changed, removed
+
+    def update_package_index(self, stale, fresh):
+        """Work out which package each descriptor in the stale (replaced or removed) and fresh (added or changed)
+           packages now comes from, once self.packages is in its new order. Returns the descriptors affected."""
+        ranks = {id(package): position for position, package in enumerate(self.packages)}
+        affected = set()
+        # Descriptors whose package has gone go to the last package still containing them, if any, found in one pass
+        # back through the packages which stops once they've all been placed
+        orphaned = set()
+        for package in stale:
+            for descriptor in package.index:
+                if self.package_index.get(descriptor) is package:
+                    orphaned.add(descriptor)
+        affected.update(orphaned)
+        for candidate in reversed(self.packages):
+            if not orphaned:
+                break
+            index = candidate.index
+            if len(index) < len(orphaned):
+                found = [descriptor for descriptor in index if descriptor in orphaned]
+            else:
+                found = [descriptor for descriptor in orphaned if descriptor in index]
+            for descriptor in found:
+                self.package_index[descriptor] = candidate
+            orphaned.difference_update(found)
+        for descriptor in orphaned:
+            del self.package_index[descriptor]
+        # New descriptors go to the new package unless a later one overrides them
+        for package in fresh:
+            position = ranks[id(package)]
+            for descriptor in package.index:
+                current = self.package_index.get(descriptor)
+                if current is None or ranks.get(id(current), -1) <= position:
+                    self.package_index[descriptor] = package
+                    affected.add(descriptor)
+        return affected
+
+    def build_column_index(self, verbose=False):
+        """Rebuild the columnar index from all the packages, then replace the package index and the packages' own
+           index and CLST dicts with views of it"""
+        self.column_index.build(self.packages, verbose)
+        for position, package in enumerate(self.packages):
+            package.index = PackageIndexView(self.column_index, position, package.indexver)
+            package.dircomp = PackageDircompView(self.column_index, position)
+        self.package_index = ColumnPackageIndex(self.column_index)
+        self.type_index = self.column_index
+
+    def build_filters(self, verbose=False):
+        """Build Bloom filters of the global index and of each package's index, so lookups that are bound to miss,
+           like most of the fallbacks tried while resolving file links, can be ruled out cheaply"""
+        self.bloom_filter = BloomFilter(len(self.package_index))
+        self.bloom_filter.add_many(self.package_index)
+        for package in self.packages:
+            package.bloom_filter = BloomFilter(len(package.index))
+            package.bloom_filter.add_many(package.index)
+        if verbose:
+            print("Built Bloom filters for %d descriptors in %d packages" % (len(self.bloom_filter), len(self.packages)))
+
+    def FilterStats(self):
+        """(probes, probes ruled out) for the global Bloom filter and all the packages' ones together"""
+        filters = [self.bloom_filter] + [package.bloom_filter for package in self.packages]
+        filters = [bloom for bloom in filters if bloom is not None]
+        return sum(bloom.probes for bloom in filters), sum(bloom.negatives for bloom in filters)
+
+    def load_packages(self, packfiles, extract_namemaps=False, workers=None, use_processes=False, stats=None,
+                      progress=None, cancel=None):
+        """Read the DBPFs in packfiles, using the index cache where it has an up to date copy, and return them in the
+           same order. stats can give the files' os.stat results, if they're already known. progress, if given, is
+           called as progress(packages done, total, bytes read) after each package. If cancel (a threading.Event) is
+           set part way through, stops and returns None; packages already read are still kept in the index cache."""
+        packages = [None] * len(packfiles)
+        total = len(packfiles)
+        done = 0
+        bytes_read = 0
+        jobs = []
+        for position, file in enumerate(packfiles):
+            if cancel is not None and cancel.is_set():
+                return None
+            stat = None
+            package = None
+            if self.cache:
+                stat = stats[file] if stats else os.stat(file)
+                package = DBPF()
+                if self.cache.lookup(package, file, stat):
+                    packages[position] = package
+                    if not (extract_namemaps and package.namemap_locations):
+                        done += 1
+                        if progress:
+                            progress(done, total, bytes_read)
+                        continue
+                else:
+                    package = None
+            jobs.append((position, file, stat, package))
+
+        def finish(job, result):
+            nonlocal done, bytes_read
+            position, file, stat, cached = job
+            package, read = result
+            packages[position] = package
+            if read and self.cache:
+                self.cache.store(package, file, stat)
+            done += 1
+            bytes_read += package.get_bytes_read(extract_namemaps, cached is None)
+            if progress:
+                progress(done, total, bytes_read)
+
+        if workers and workers > 1 and len(jobs) > 1:
+            executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+            with executor_class(max_workers=workers) as executor:
+                futures = [executor.submit(ReadPackage, file, extract_namemaps, package)
+                           for _, file, _, package in jobs]
+                for job, future in zip(jobs, futures):
+                    finish(job, future.result())
+                    if cancel is not None and cancel.is_set():
+                        # Drop the reads that haven't started (shutdown's cancel_futures needs Python 3.9)
+                        for pending in futures:
+                            pending.cancel()
+                        executor.shutdown(wait=False)
+                        return None
+        else:
+            for job in jobs:
+                finish(job, ReadPackage(job[1], extract_namemaps, job[3]))
+                if cancel is not None and cancel.is_set():
+                    return None
+        if cancel is not None and cancel.is_set():
+            return None
+        return packages
     
+    def PrebuildNamemaps(self, workers=None, use_processes=False, verbose=False):
+        """Build namemaps for all the packages without an NMAP that don't already have them from the index cache, in a
+           worker pool if workers is more than 1, and save them in the cache. Saves findname building them on the fly
+           part way through resolving links."""
+        pending = [package for package in self.packages
+                   if not package.namemap_locations and not (package.generated_namemaps and package.namemaps)]
+        if verbose:
+            print("Building namemaps for %d packages" % len(pending))
+        files = [package.file for package in pending]
+        if workers and workers > 1 and len(pending) > 1:
+            executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+            with executor_class(max_workers=workers) as executor:
+                results = list(executor.map(BuildPackageNamemaps, files, chunksize=16))
+        else:
+            results = [BuildPackageNamemaps(file) for file in files]
+        for package, namemaps in zip(pending, results):
+            if namemaps is None:
+                continue
+            package.namemaps = namemaps
+            package.generated_namemaps = True
+            if self.cache:
+                self.cache.store_namemaps(package)
+        if self.cache:
+            self.cache.save(verbose)
+        return len(pending)
+
     def extract_namemap(self, package, verbose=False):
         if not package.namemaps:
             #package.build_namemaps()
             pass
-        if package.namemaps:
-            for rcol_type, namemap in package.namemaps.items():
-                if rcol_type not in self.meta_namemap:
-                    self.meta_namemap[rcol_type] = {}
-                self.meta_namemap[rcol_type].update(namemap)
-
-    def GetRCOLsByType(self, rtype):
-        for descriptor in self.package_index:
-            dtype = GetTypeFromDescriptor(descriptor)
-            if rtype == dtype:
-                yield descriptor
+        self.name_index.add_package(package, package.owner)
+
+    def GetRCOLsByType(self, rtype, group=None, instance_min=None, instance_max=None):
+        """Descriptors of all resources of type rtype, in (group, instance, resource) order, optionally only those in
+           group and in an instance range"""
+        return self.type_index.descriptors(rtype, group, instance_min, instance_max)
+
+    def CountRCOLsByType(self, rtype):
+        return self.type_index.count(rtype)
     
+    def find_descriptor(self, descriptor):
+        """The descriptor under which a resource is in the global index, falling back to a zero resource ID, or None.
+           Asks the Bloom filter first, if there is one."""
+        descriptor = ToDescriptor(descriptor)
+        bloom = self.bloom_filter
+        if (bloom is None or bloom.might_contain(descriptor)) and descriptor in self.package_index:
+            return descriptor
+        descriptor = WithoutResource(descriptor)
+        if (bloom is None or bloom.might_contain(descriptor)) and descriptor in self.package_index:
+            return descriptor
+        return None
+
     def GetRCOL(self, descriptor, verbose=False):
-        if descriptor not in self.package_index:
-            descriptor = descriptor[0:12] + bytes.fromhex('00000000')
-        if descriptor in self.package_index:
+        descriptor = self.find_descriptor(descriptor)
+        if descriptor is not None:
             package = self.package_index[descriptor]
-            return package.get_RCOL(descriptor, verbose)
+            return self.session.get_RCOL(package, descriptor, verbose)
         else:
             #raise RuntimeError("Can't find descriptor in package list")
             return None
     
+    def get_block_index(self, package, verbose=False):
+        """The BlockIndex for package, loading it or, if it's missing or out of date, building and saving it"""
+        if package.block_index is None:
+            stat = os.stat(package.file)
+            block_index = BlockIndex(package.file, self.block_index_dir)
+            if not block_index.load(stat, verbose):
+                block_index.build(package, verbose)
+                block_index.save(stat, verbose)
+            package.block_index = block_index
+        return package.block_index
+
+    def BuildBlockIndices(self, verbose=False):
+        """Make sure every package has an up to date block index"""
+        for package in self.packages:
+            self.get_block_index(package, verbose)
+
+    def GetLinks(self, descriptor, verbose=False):
+        """Descriptors of the RCOLs linked to by descriptor, from the block index rather than by reading it"""
+        descriptor = self.find_descriptor(descriptor)
+        if descriptor is None:
+            return None
+        package = self.package_index[descriptor]
+        return self.get_block_index(package, verbose).get_links(descriptor)
+
+    def GetRCOLBlock(self, descriptor, block, verbose=False):
+        """Data block number block of an RCOL. The RCOL is read lazily, so with the block index's offsets no other
+           blocks are parsed."""
+        descriptor = self.find_descriptor(descriptor)
+        if descriptor is None:
+            return None
+        package = self.package_index[descriptor]
+        self.get_block_index(package, verbose)
+        rcol = self.session.get_RCOL(package, descriptor, verbose, lazy=True)
+        return rcol.rcoldata[block]
+
     def GetRCOLByName(self, rcol_type, rcol_name, verbose=False):
         descriptor = self.findname(rcol_type, rcol_name)
         rcol = self.GetRCOL(descriptor)
         if not rcol:
             if verbose:
                 print("Couldn't locate descriptor: %s" % str(DecodeDescriptor(descriptor)))
-            resource = sims2crc32(rcol_name.lower().encode('ascii'))
-            resource_bytes = struct.pack('I', resource)
-            descriptor = b''.join((descriptor, resource_bytes))
+            descriptor = WithResource(descriptor, sims2_resource_id(rcol_name))
             rcol = self.GetRCOL(descriptor)
             if not rcol:
                 print("Couldn't locate descriptor: %s" % str(DecodeDescriptor(descriptor)))
@@ -330,21 +837,18 @@ class PackageManager:
         return rcol
 
     def findname(self, rcol_type, rcol_name, verbose=False):
-        if not self.meta_namemap:
-            print("Using findname but meta namemap hasn't been generated, generating now")
+        if not self.name_index:
+            print("Using findname but name index hasn't been generated, generating now")
             for package in self.packages:
                 if not package.namemaps:
-                    with open(package.file, 'rb') as fh:
+                    with package.filehandle() as fh:
                         package.extract_namemaps(fh)
                 self.extract_namemap(package)
-        if rcol_type not in self.meta_namemap:
-            raise RuntimeError("Can't find RCOL type \"%s\" in meta namemap" % str(rcol_type))            
-        namemap = self.meta_namemap[rcol_type]
-        if rcol_name.lower() not in namemap:
+        if not self.name_index.has_type(rcol_type):
+            raise RuntimeError("Can't find RCOL type \"%s\" in name index" % str(rcol_type))
+        descriptor = self.name_index.find(rcol_type, rcol_name)
+        if descriptor is None:
             if False:
-                from pprint import pprint
-                pprint(namemap)
-                #pprint(self.meta_namemap)
                 for pack in self.packages:
                     if not pack.namemaps:
                         print ("No namemaps for file %s" % pack.file)
@@ -353,4 +857,4 @@ class PackageManager:
                     elif rcol_name in pack.namemaps[rcol_type]:
                         print("Found in namemap for file %s" % pack.file)
             raise RuntimeError("Can't find \"%s\" in \"%s\" namemap" % (rcol_name, str(rcol_type)))
-        return namemap[rcol_name.lower()]
\ No newline at end of file
+        return descriptor
\ No newline at end of file
@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+import collections
+
+class PayloadCache:
+    """Byte-budgeted LRU cache of decompressed resource payloads, keyed by (package path, descriptor). Payloads are
+       shared between DataGenerators, which only ever read them."""
+
+    def __init__(self, max_bytes=256*1024*1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        payload = self.entries.get(key)
+        if payload is None:
+            self.misses += 1
+        else:
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return payload
+
+    def put(self, key, payload):
+        size = len(payload)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.current_bytes -= len(self.entries.pop(key))
+        self.entries[key] = payload
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.current_bytes -= len(evicted)
+            self.evictions += 1
+
+    def discard_file(self, path):
+        """Drop the payloads from package path, e.g. because it's changed on disk"""
+        for key in [key for key in self.entries if key[0] == path]:
+            self.current_bytes -= len(self.entries.pop(key))
+
+    def clear(self):
+        self.entries.clear()
+        self.current_bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return "%d payloads, %d of %d bytes, hits = %d, misses = %d, evictions = %d" % (len(self.entries), self.current_bytes,
+                                                                                       self.max_bytes, self.hits, self.misses,
+                                                                                       self.evictions)
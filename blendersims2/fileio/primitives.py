@@ -3,7 +3,7 @@
 
 from abc import ABCMeta, abstractmethod
 
-from blendersims2.fileio.parseutils import ParseBool, ParseName
+from blendersims2.fileio.parseutils import ParseName
 from blendersims2.fileio.dumputils import indented_print
 
 class Sims2Reader(metaclass=ABCMeta):
@@ -30,9 +30,7 @@ class NamePair(Sims2Reader):
 
 class Chain(Sims2Reader):
     def extract(self, dg, verbose=False):
-        self.enabled = ParseBool(dg)
-        self.subnode = ParseBool(dg)
-        self.node = dg.get_dword()
+        self.enabled, self.subnode, self.node = dg.get_chain()
         
     def __str__(self):
         res = str()
@@ -45,9 +43,13 @@ class Chain(Sims2Reader):
         
 class Translation(Sims2Reader):
     def extract(self, dg, verbose=False):
-        self.x = dg.get_float()
-        self.y = dg.get_float()
-        self.z = dg.get_float()
+        self.x, self.y, self.z = dg.get_vec3()
+
+    @classmethod
+    def from_values(cls, values):
+        res = cls()
+        res.x, res.y, res.z = values
+        return res
         
     def __str__(self):
         return "x = %f, y = %f, z = %f" % (self.x, self.y, self.z)
@@ -57,10 +59,13 @@ class Translation(Sims2Reader):
 
 class Quaternion(Sims2Reader):
     def extract(self, dg, verbose=False):
-        self.x = dg.get_float()
-        self.y = dg.get_float()
-        self.z = dg.get_float()
-        self.w = dg.get_float()
+        self.x, self.y, self.z, self.w = dg.get_quat()
+
+    @classmethod
+    def from_values(cls, values):
+        res = cls()
+        res.x, res.y, res.z, res.w = values
+        return res
 
     def __str__(self):
         return "x = %f, y = %f, z = %f, w = %f" % (self.x, self.y, self.z, self.w)
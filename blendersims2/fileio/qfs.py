@@ -0,0 +1,281 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+import struct
+
+QFS_ID = 0xfb10
+QFS_HEADER_SIZE = 9    # Compressed size DWORD, 0x10fb ID WORD, big-endian uint24 decompressed size
+
+def decompress(data, decompsize, verbose=False):
+    """Decompress a QFS/RefPack payload (everything after the 9 byte header) into a bytearray of decompsize bytes"""
+    src = memoryview(data)
+    srclen = len(src)
+    output = bytearray()
+    rptr = 0
+    wptr = 0
+
+    try:
+        while wptr < decompsize:
+            byte0 = src[rptr]
+            if byte0 < 0x80:
+                byte1 = src[rptr + 1]
+                rptr += 2
+                num_plain_text = (byte0 & 0x03)
+                num_to_copy = ((byte0 & 0x1c) >> 2) + 3
+                copy_offset = ((byte0 & 0x60) << 3) + byte1 + 1
+            elif byte0 < 0xc0:
+                byte1 = src[rptr + 1]
+                byte2 = src[rptr + 2]
+                rptr += 3
+                num_plain_text = ((byte1 & 0xc0) >> 6)
+                num_to_copy = (byte0 & 0x3f) + 4
+                copy_offset = ((byte1 & 0x3f) << 8) + byte2 + 1
+            elif byte0 < 0xe0:
+                byte1 = src[rptr + 1]
+                byte2 = src[rptr + 2]
+                byte3 = src[rptr + 3]
+                rptr += 4
+                num_plain_text = (byte0 & 0x03)
+                num_to_copy = ((byte0 & 0x0C) << 6) + byte3 + 5
+                copy_offset = ((byte0 & 0x10) << 12) + (byte1 << 8) + byte2 + 1
+            elif byte0 < 0xfd:
+                rptr += 1
+                num_plain_text = ((byte0 & 0x1F) << 2) + 4
+                num_to_copy = 0
+            else:
+                rptr += 1
+                num_plain_text = (byte0 & 0x03)
+                num_to_copy = 0
+
+            if verbose:
+                print("Num plain text = %d" % num_plain_text, end='')
+                if num_to_copy > 0:
+                    print(", num to copy = %d, copy offset = %d" % (num_to_copy, copy_offset))
+                else:
+                    print()
+
+            # Copy plain text from input stream. Appending to the output is cheaper than assigning into a
+            # preallocated buffer, since bytearray over-allocates as it grows.
+            if num_plain_text:
+                if wptr + num_plain_text > decompsize:
+                    raise ValueError("Decompressed larger than expected!")
+                if rptr + num_plain_text > srclen:
+                    raise IndexError
+                output += src[rptr:(rptr + num_plain_text)]
+                rptr += num_plain_text
+                wptr += num_plain_text
+
+            # Copy from earlier in the output. If the source and destination overlap the source is a repeating pattern
+            # of copy_offset bytes, so copy it in chunks which double in size each time rather than a byte at a time
+            if num_to_copy:
+                start = wptr - copy_offset
+                if start < 0:
+                    raise ValueError("Back-reference to offset %d is before the start of the buffer" % start)
+                if wptr + num_to_copy > decompsize:
+                    raise ValueError("Decompressed larger than expected!")
+                if copy_offset >= num_to_copy:
+                    output += output[start:(start + num_to_copy)]
+                else:
+                    remaining = num_to_copy
+                    while remaining:
+                        chunk = min(len(output) - start, remaining)
+                        output += output[start:(start + chunk)]
+                        remaining -= chunk
+                wptr += num_to_copy
+    except IndexError:
+        raise ValueError("Compressed data ended after %d bytes, having decompressed %d of %d bytes" % (srclen, wptr, decompsize))
+
+    return output
+
+class StreamDecompressor:
+    """Decompresses a QFS/RefPack payload (everything after the 9 byte header) incrementally, as the output is asked
+       for, so a parser can start on the first bytes before the rest are inflated, or stop early and never inflate
+       them. Back-references reach at most WINDOW bytes back, so only that much history is kept, plus whatever the
+       reader hasn't released yet. Positions are offsets into the whole decompressed payload. How far ahead it
+       decompresses starts small and doubles with each fill, so a reader that only wants the first few hundred bytes
+       doesn't pay for much more."""
+
+    WINDOW = 131072     # Largest copy offset the format can encode
+    FIRST_CHUNK = 512   # Decompress at least this far ahead the first time
+    CHUNK = 65536       # and at most this far ahead, once reads have kept coming
+
+    def __init__(self, data, decompsize):
+        self.src = memoryview(data)
+        self.decompsize = decompsize
+        self.rptr = 0
+        self.output = bytearray()
+        self.base = 0           # Position of output[0]
+        self.produced = 0       # Position of the end of output
+        self.released = 0
+        self.ahead = self.FIRST_CHUNK
+
+    def done(self):
+        return self.produced >= self.decompsize
+
+    def fill(self, target):
+        """Decompress until at least target bytes have been produced, or the end of the payload"""
+        decompsize = self.decompsize
+        target = min(max(target, self.produced + self.ahead), decompsize)
+        self.ahead = min(self.ahead * 2, self.CHUNK)
+        src = self.src
+        srclen = len(src)
+        output = self.output
+        rptr = self.rptr
+        wptr = self.produced
+        base = self.base
+
+        try:
+            while wptr < target:
+                byte0 = src[rptr]
+                if byte0 < 0x80:
+                    byte1 = src[rptr + 1]
+                    rptr += 2
+                    num_plain_text = (byte0 & 0x03)
+                    num_to_copy = ((byte0 & 0x1c) >> 2) + 3
+                    copy_offset = ((byte0 & 0x60) << 3) + byte1 + 1
+                elif byte0 < 0xc0:
+                    byte1 = src[rptr + 1]
+                    byte2 = src[rptr + 2]
+                    rptr += 3
+                    num_plain_text = ((byte1 & 0xc0) >> 6)
+                    num_to_copy = (byte0 & 0x3f) + 4
+                    copy_offset = ((byte1 & 0x3f) << 8) + byte2 + 1
+                elif byte0 < 0xe0:
+                    byte1 = src[rptr + 1]
+                    byte2 = src[rptr + 2]
+                    byte3 = src[rptr + 3]
+                    rptr += 4
+                    num_plain_text = (byte0 & 0x03)
+                    num_to_copy = ((byte0 & 0x0C) << 6) + byte3 + 5
+                    copy_offset = ((byte0 & 0x10) << 12) + (byte1 << 8) + byte2 + 1
+                elif byte0 < 0xfd:
+                    rptr += 1
+                    num_plain_text = ((byte0 & 0x1F) << 2) + 4
+                    num_to_copy = 0
+                else:
+                    rptr += 1
+                    num_plain_text = (byte0 & 0x03)
+                    num_to_copy = 0
+
+                if num_plain_text:
+                    if wptr + num_plain_text > decompsize:
+                        raise ValueError("Decompressed larger than expected!")
+                    if rptr + num_plain_text > srclen:
+                        raise IndexError
+                    output += src[rptr:(rptr + num_plain_text)]
+                    rptr += num_plain_text
+                    wptr += num_plain_text
+
+                # As in decompress, an overlapping copy repeats the last copy_offset bytes, so copy in doubling chunks
+                if num_to_copy:
+                    start = wptr - copy_offset - base
+                    if start < 0:
+                        raise ValueError("Back-reference to offset %d is before the start of the buffer" % (start + base))
+                    if wptr + num_to_copy > decompsize:
+                        raise ValueError("Decompressed larger than expected!")
+                    if copy_offset >= num_to_copy:
+                        output += output[start:(start + num_to_copy)]
+                    else:
+                        remaining = num_to_copy
+                        while remaining:
+                            chunk = min(len(output) - start, remaining)
+                            output += output[start:(start + chunk)]
+                            remaining -= chunk
+                    wptr += num_to_copy
+        except IndexError:
+            raise ValueError("Compressed data ended after %d bytes, having decompressed %d of %d bytes" % (srclen, wptr, decompsize))
+
+        self.rptr = rptr
+        self.produced = wptr
+
+    def read(self, position, n):
+        """n bytes from position, or fewer at the end of the payload. Reading past what's been produced so far counts
+           as releasing everything before position, so a reader moving forwards keeps memory bounded without asking."""
+        end = min(position + n, self.decompsize)
+        if end > self.produced:
+            self.release(position)
+            self.fill(end)
+        if position < self.base:
+            raise ValueError("Streamed data before offset %d has already been released" % self.base)
+        start = position - self.base
+        return bytes(self.output[start:(end - self.base)])
+
+    def release(self, position):
+        """The reader won't go back before position, so output before it can be dropped once it's out of the window"""
+        self.released = max(self.released, position)
+        keep = min(self.released, self.produced - self.WINDOW)
+        # Dropping from the front of a bytearray is cheap, but only bother once there's a window's worth
+        if keep - self.base >= self.WINDOW:
+            del self.output[:(keep - self.base)]
+            self.base = keep
+
+    def finish(self):
+        """Decompress the rest and return the whole payload, which must not have been released"""
+        if self.base:
+            raise ValueError("Streamed data before offset %d has already been released" % self.base)
+        self.fill(self.decompsize)
+        return self.output
+
+def _flush_literals(out, data, start, end):
+    """Emit plain text commands for data[start:end], leaving up to 3 bytes to be attached to the next command"""
+    while end - start > 3:
+        count = min(112, (end - start) & ~0x03)
+        out.append(0xe0 + ((count - 4) >> 2))
+        out += data[start:(start + count)]
+        start += count
+    return start
+
+def compress(data):
+    """Greedy QFS/RefPack compressor, including the 9 byte header. Used to build test and benchmark data, so aims for
+       valid output rather than the best possible compression ratio."""
+    data = bytes(data)
+    size = len(data)
+    if size > 0xffffff:
+        raise ValueError("QFS can't represent a decompressed size of %d bytes" % size)
+    out = bytearray(struct.pack('<IH', 0, QFS_ID))
+    out += bytes(((size >> 16) & 0xff, (size >> 8) & 0xff, size & 0xff))
+
+    table = {}
+    pos = 0
+    lit_start = 0
+    while pos + 3 <= size:
+        key = data[pos:(pos + 3)]
+        candidate = table.get(key)
+        table[key] = pos
+        if candidate is not None:
+            offset = pos - candidate
+            length = 3
+            maxlen = min(1028, size - pos)
+            while length < maxlen and data[candidate + length] == data[pos + length]:
+                length += 1
+            if offset <= 1024 and length <= 10:
+                encoding = 2
+            elif offset <= 16384 and 4 <= length <= 67:
+                encoding = 3
+            elif offset <= 131072 and length >= 5:
+                encoding = 4
+            else:
+                encoding = None
+            if encoding:
+                lit_start = _flush_literals(out, data, lit_start, pos)
+                plain = pos - lit_start
+                o = offset - 1
+                if encoding == 2:
+                    out += bytes((((o >> 3) & 0x60) | ((length - 3) << 2) | plain, o & 0xff))
+                elif encoding == 3:
+                    out += bytes((0x80 | (length - 4), (plain << 6) | (o >> 8), o & 0xff))
+                else:
+                    l = length - 5
+                    out += bytes((0xc0 | ((o >> 12) & 0x10) | ((l >> 6) & 0x0c) | plain, (o >> 8) & 0xff, o & 0xff, l & 0xff))
+                out += data[lit_start:pos]
+                pos += length
+                lit_start = pos
+                continue
+        pos += 1
+
+    # Whatever is left goes out as plain text, the last 0-3 bytes attached to the stop command
+    lit_start = _flush_literals(out, data, lit_start, size)
+    out.append(0xfc + (size - lit_start))
+    out += data[lit_start:size]
+    struct.pack_into('<I', out, 0, len(out))
+    return bytes(out)
@@ -5,7 +5,7 @@ from blendersims2.fileio.datagenerator import DataGenerator
 from blendersims2.fileio.errors import RCOLNotSupported
 from blendersims2.fileio.rcol.common import RCOLHeader
 
-from blendersims2.fileio.node import cTransformNode, cBoneDataExtension
+from blendersims2.fileio.node import Node, cTransformNode, cBoneDataExtension
 import blendersims2.fileio.rcol.builders
 import blendersims2.fileio.rcol.cres
 import blendersims2.fileio.rcol.extension
@@ -18,21 +18,86 @@ import blendersims2.fileio.rcol.viewer
 cTransformNode.register()
 cBoneDataExtension.register()
 
+class LazyBlocks:
+    """The data blocks of a lazily read RCOL, each parsed the first time it's accessed. Blocks don't record their
+       size, so a block's offset is only known once the one before it has been parsed, unless a recorded offset table
+       was supplied. Offsets are relative to the start of the RCOL, with one extra for the end of the last block."""
+
+    def __init__(self, dg, rcol_ids, base, offsets=None):
+        self.dg = dg
+        self.rcol_ids = rcol_ids
+        self.base = base
+        self.blocks = [None] * len(rcol_ids)
+        self.parsed = 0
+        self.offsets = [None] * (len(rcol_ids) + 1)
+        self.offsets[0] = dg.tell() - base
+        if offsets:
+            # A recorded table may only cover the first few blocks
+            known = min(len(offsets), len(self.offsets))
+            self.offsets[:known] = offsets[:known]
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(len(self.blocks)))]
+        if index < 0:
+            index += len(self.blocks)
+        if index < 0 or index >= len(self.blocks):
+            raise IndexError("RCOL data block index out of range")
+        if self.blocks[index] is None:
+            # Walk forward from the nearest block whose offset we know
+            start = index
+            while self.offsets[start] is None:
+                start -= 1
+            for position in range(start, index + 1):
+                self.parse(position)
+        return self.blocks[index]
+
+    def __iter__(self):
+        for index in range(len(self.blocks)):
+            yield self[index]
+
+    def parse(self, index):
+        self.dg.goto(self.base + self.offsets[index])
+        self.blocks[index] = self.rcol_ids[index].RCOLConstructor()(self.dg)
+        self.offsets[index + 1] = self.dg.tell() - self.base
+        self.parsed += 1
+        if self.parsed == len(self.blocks):
+            # Everything's been read, so let go of the data
+            self.dg = None
+
+    def resolvable(self):
+        """The blocks that have links to resolve, leaving the rest (e.g. GMDC geometry) unparsed where possible"""
+        for index, rcol_id in enumerate(self.rcol_ids):
+            if rcol_id.RCOLConstructor().resolve is not Node.resolve:
+                yield self[index]
+
 class RCOL:
     """Sims2 Scenegraph Resource Collection"""
     
-    def __init__(self, fh=None, identifier=None, offset=None, size=None, decompressed_size=None, dbpf=None, verbose=False):
+    def __init__(self, fh=None, identifier=None, offset=None, size=None, decompressed_size=None, dbpf=None, verbose=False, dg=None,
+                 lazy=False, offsets=None):
         self.dbpf = dbpf
         self.identifier = identifier
         if fh:
             # Create a data generator which is a bit smarter than a file handle, to simplify reads from data blocks which may or may not be compressed
             dg = DataGenerator(fh, offset, size, decompressed_size, verbose)
+        if dg:
             if verbose:
-                self.extract(dg, verbose=True)
+                self.extract(dg, verbose=True, lazy=lazy, offsets=offsets)
             else:
-                self.extract(dg)
+                self.extract(dg, lazy=lazy, offsets=offsets)
 
-    def extract(self, dg, verbose=False, debug=True):
+    def extract(self, dg, verbose=False, debug=True, lazy=False, offsets=None):
+        """Read the header and data blocks. If lazy, only the header (and so the file links) is read now and the data
+           blocks are parsed when accessed through rcoldata; offsets is an optional table of block offsets from
+           get_block_offsets, letting any block be read without parsing those before it."""
+        if lazy:
+            # The blocks are read later, when the file handle may be closed or in use elsewhere
+            dg.detach()
+        base = dg.tell()
         if verbose:
             print("Creating RCOL header")
         self.header = RCOLHeader(dg, verbose)
@@ -40,14 +105,19 @@ class RCOL:
         if verbose:
             print("RCOL header done, starting data blocks (item count %s)" % self.header.item_count)
         self.rcoldata = []
+        self.offsets = [dg.tell() - base]
         if debug:
             self.unsupported = []
+        count = 0
         for datablock in range(self.header.item_count):
             rcol_id = self.header.rcol_ids[datablock]
             if verbose:
                 print("Data block %s has type %s" % (datablock, str(rcol_id)))
             if rcol_id.is_rcol():
-                self.rcoldata.append(rcol_id.RCOLConstructor()(dg))
+                if not lazy:
+                    self.rcoldata.append(rcol_id.RCOLConstructor()(dg))
+                    self.offsets.append(dg.tell() - base)
+                count += 1
             elif debug:
                 if rcol_id not in self.unsupported:
                     self.unsupported.append(rcol_id)
@@ -55,8 +125,18 @@ class RCOL:
                 break
             else:
                 raise RCOLNotSupported("Unsupported RCOL Type %s" % str(rcol_id))
+        if lazy:
+            self.rcoldata = LazyBlocks(dg, self.header.rcol_ids[:count], base, offsets)
         if verbose:
             print("Done!")
+
+    def get_block_offsets(self):
+        """Offsets of the data blocks from the start of the RCOL, followed by the end of the last, as far as they're
+           known; for a lazy RCOL that's up to the end of the last block parsed in order"""
+        offsets = self.rcoldata.offsets if isinstance(self.rcoldata, LazyBlocks) else self.offsets
+        if None in offsets:
+            offsets = offsets[:offsets.index(None)]
+        return list(offsets)
             
     @classmethod
     def get_name(cls, dg, identifier, verbose=False):
@@ -81,10 +161,20 @@ class RCOL:
         return self.identifier.group;
     
     def ResolveAllLinks(self, packman, verbose=False):
-        for link in self.header.filelinks:
-            link.resolve(packman, self.dbpf, parent_group=self.identifier.group, verbose=verbose)
-        for rcol in self.rcoldata:
-            rcol.resolve(packman, self.dbpf, verbose)
+        # The session makes sure each RCOL is only resolved once, and stops cycles recursing forever
+        if not packman.session.begin(self):
+            return
+        try:
+            for link in self.header.filelinks:
+                link.resolve(packman, self.dbpf, parent_group=self.identifier.group, verbose=verbose)
+            # Lazy RCOLs only parse the blocks which have something to resolve
+            blocks = self.rcoldata.resolvable() if isinstance(self.rcoldata, LazyBlocks) else self.rcoldata
+            for rcol in blocks:
+                rcol.resolve(packman, self.dbpf, verbose)
+        except BaseException:
+            packman.session.abort(self)
+            raise
+        packman.session.end(self)
     
     def dump(self, indent=0):
         self.header.dump(indent)
@@ -1,10 +1,8 @@
 #!/usr/bin/python3
 #-*- coding: utf-8 -*-
 
-import struct
-
 from blendersims2.fileio.parseutils import ParseName, ParseBool
-from blendersims2.fileio.tgir import PackedFile
+from blendersims2.fileio.tgir import PackedFile, MakeDescriptor
 from blendersims2.fileio.node import Node
 from blendersims2.fileio.rcol.common import RCOLDataBlock
 
@@ -245,7 +243,7 @@ class cProcessDeformationsBuilder(RCOLDataBlock):
         
         # GMDC reference
         data = dg.get_dwords(3)
-        self.gmdc_ref = struct.pack('3I', data[2], data[0], data[1])
+        self.gmdc_ref = MakeDescriptor(data[2], data[0], data[1])
         
         self.enabled = ParseBool(dg)
         self.mesh = ParseBool(dg)
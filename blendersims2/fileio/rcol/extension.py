@@ -71,7 +71,7 @@ class DataExtension(Extension):
     def extract(self, dg, verbose=False):
         super(DataExtension, self).extract(dg, verbose)
         count = dg.get_dword()
-        self.data = dg.read(count)
+        self.data = bytes(dg.read(count))    # Copy so as not to hold a view of the package's mmap
         if verbose:
             print("DataExtension type: %s" % type(self.data))
         
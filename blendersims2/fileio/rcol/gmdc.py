@@ -117,28 +117,26 @@ class Element(GMDCSection):
         if block_size % (setlength * 4) != 0:
             raise ValueError("Block size (%d) is not an integer multiple of setlength*4 (%d)" % (block_size, setlength))
         listLength = block_size // (setlength * 4)
+        self.setlength = setlength
+        self.list_length = listLength
         
-        self.block = []
+        # Whole block in one read, as a (listLength, setlength) array which can go straight to foreach_set
         if self.block_format == 4:
-            block_func = dg.get_dword
+            block_type = 'I'
         else:
-            block_func = dg.get_float
-        for _ in range(listLength):
-            for _ in range(setlength):
-                self.block.append(block_func())
+            block_type = 'f'
+        self.block = dg.get_array(block_type, listLength * setlength, (listLength, setlength))
 
         item_count = dg.get_dword()
-        self.items = []
         if self.version == 4:
-            item_func = dg.get_word
+            item_type = 'H'
         else:
-            item_func = dg.get_dword
-        for _ in range(item_count):
-            self.items.append(item_func())
+            item_type = 'I'
+        self.items = dg.get_array(item_type, item_count)
             
     def __str__(self):
         return "RefArraySize = %d, %s %d, %s, %s, block(%d), items(%d)" % (self.refarray_size, str(self.identity), self.repetition, self.block_format,
-                                                                           str(self.set_group), len(self.block), len(self.items))
+                                                                           str(self.set_group), self.list_length * self.setlength, len(self.items))
 
 class Linkage(GMDCSection):
     
@@ -174,11 +172,9 @@ class Group(GMDCSection):
         
         # Integer type based on GMDC version
         if self.version == 4:
-            face_func = dg.get_words
-            subset_func = dg.get_word
+            index_type = 'H'
         else:
-            face_func = dg.get_dwords
-            subset_func = dg.get_dword
+            index_type = 'I'
         
         # Basics
         self.primitive_type = dg.get_dword()
@@ -193,9 +189,8 @@ class Group(GMDCSection):
             print ("Face count = %d" % (face_count // 3))
         if (face_count % 3) != 0:
             raise ValueError("Face count (%d) is not a multiple of 3, current offset: %d (%s)" % (face_count, dg.tell(), hex(dg.tell())))
-        self.faces = []
-        for _ in range(face_count // 3):
-            self.faces.append(face_func(3))    # N.B. As get_dwords returns a list, and we're using append rather than extend, this creates a list of lists
+        self.face_count = face_count // 3
+        self.faces = dg.get_array(index_type, face_count, (self.face_count, 3))    # One (n, 3) array rather than a tuple per face
             
         # Opacity
         self.opacity = dg.get_dword()
@@ -205,12 +200,10 @@ class Group(GMDCSection):
             subset_count = dg.get_dword()
             if verbose:
                 print ("Subset count = %d" % subset_count)
-            self.subsets = []
-            for _ in range(subset_count):
-                self.subsets.append(subset_func())
+            self.subsets = dg.get_array(index_type, subset_count)
         
     def __str__(self, indent=0):
-        res = "%s: Prim type = %d, link index = %d, opacity = %s, faces = %d" % (self.name, self.primitive_type, self.link_index, hex(self.opacity), len(self.faces))
+        res = "%s: Prim type = %d, link index = %d, opacity = %s, faces = %d" % (self.name, self.primitive_type, self.link_index, hex(self.opacity), self.face_count)
         if self.version == 2 or self.version == 4:
             res += ", subsets = %d" % len(self.subsets)
         return res
@@ -248,24 +241,22 @@ class Subset(GMDCSection):
         vertex_count = dg.get_dword()
         if vertex_count > 0:
             face_count = dg.get_dword()
-            self.vertices = []
-            self.faces = []
-            for _ in range(vertex_count):
-                self.vertices.append(dg.get_dwords(3))    # N.B. As get_dwords returns a list, and we're using append rather than extend, this creates a list of lists
+            self.vertex_count = vertex_count
+            self.face_count = face_count // 3
+            self.vertices = dg.get_array('I', vertex_count * 3, (vertex_count, 3))
             # Integer type based on GMDC version
             if self.version == 4:
-                face_func = dg.get_words
+                index_type = 'H'
             else:
-                face_func = dg.get_dwords
-            for _ in range(face_count // 3):
-                self.faces.append(face_func(3))
+                index_type = 'I'
+            self.faces = dg.get_array(index_type, self.face_count * 3, (self.face_count, 3))
         else:
             self.vertices = None
             self.faces = None
             
     def __str__(self):
-        if self.vertices:
-            return "Vertices(%d), Faces(%d)" % (len(self.vertices), len(self.faces))
+        if self.vertices is not None:
+            return "Vertices(%d), Faces(%d)" % (self.vertex_count, self.face_count)
         else:
             return "No vertices"
 
@@ -1,13 +1,11 @@
 #!/usr/bin/python3
 #-*- coding: utf-8 -*-
 
-import struct
-
-from blendersims2.fileio.crcutils import sims2crc32
+from blendersims2.fileio.crcutils import sims2_resource_id
 from blendersims2.fileio.parseutils import ParseName, ParseBool
 from blendersims2.fileio.dumputils import indented_print, DumpName
 from blendersims2.fileio.primitives import Sims2Reader, Chain
-from blendersims2.fileio.tgir import PackedFile, DecodeDescriptor
+from blendersims2.fileio.tgir import PackedFile, DecodeDescriptor, WithResource
 from blendersims2.fileio.rcol.common import RCOLDataBlock
 from blendersims2.fileio.node import cSGResource, cReferentNode, cObjectGraphNode, cRenderableNode, cBoundedNode, cTransformNode
 
@@ -43,9 +41,7 @@ class LOD(Sims2Reader):
                     raise ValueError("Failed to find target descriptor for %s in name maps" % self.name)
             self.target = packman.GetRCOL(targ_descriptor)
             if not self.target:
-                resource = sims2crc32(self.name.lower().encode('ascii'))
-                resource_bytes = struct.pack('I', resource)
-                descriptor = b''.join((targ_descriptor, resource_bytes))
+                descriptor = WithResource(targ_descriptor, sims2_resource_id(self.name))
                 self.target = packman.GetRCOL(descriptor)
             self.target.ResolveAllLinks(packman, verbose)
 
@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+from blendersims2.fileio.tgir import DecodeDescriptor
+
+class ResolutionSession:
+    """Memoizes parsed and resolved RCOLs for a PackageManager. RCOLs are keyed by the package they come from and the
+       descriptor actually found in its index, so every link to the same resource shares one object and the resolved
+       links form a DAG rather than a tree. Cycles are detected and reported rather than followed."""
+
+    RESOLVING = 1
+    RESOLVED = 2
+
+    def __init__(self):
+        self.rcols = {}     # (package file, descriptor) -> RCOL
+        self.states = {}    # id(rcol) -> (rcol, state)
+        self.cycles = []    # Identifiers of RCOLs found linking back to themselves
+        self.parses = 0
+        self.reuses = 0
+
+    def get_RCOL(self, dbpf, descriptor, verbose=False, lazy=None):
+        canonical = dbpf.find_descriptor(descriptor)
+        if canonical is None:
+            if dbpf.bloom_filter is not None and not verbose:
+                # With Bloom filters, misses are expected and cheap, so don't spend time reporting them
+                return None
+            # Let the package report the failure
+            return dbpf.get_RCOL(descriptor, verbose)
+        key = (dbpf.file, canonical)
+        rcol = self.rcols.get(key)
+        if rcol is None:
+            rcol = dbpf.get_RCOL(canonical, verbose, lazy)
+            self.rcols[key] = rcol
+            self.parses += 1
+        else:
+            self.reuses += 1
+            if verbose:
+                print("Reusing RCOL %s" % str(DecodeDescriptor(canonical)))
+        return rcol
+
+    def begin(self, rcol):
+        """Called before resolving the links of rcol. Returns False if that's already done or under way."""
+        entry = self.states.get(id(rcol))
+        if entry is None:
+            self.states[id(rcol)] = (rcol, self.RESOLVING)
+            return True
+        if entry[1] == self.RESOLVING:
+            self.cycles.append(rcol.identifier)
+            print("Cycle detected resolving links of %s" % str(rcol.identifier))
+        return False
+
+    def end(self, rcol):
+        self.states[id(rcol)] = (rcol, self.RESOLVED)
+
+    def abort(self, rcol):
+        """Called if resolving rcol fails, so a later attempt starts again rather than looking like a cycle"""
+        self.states.pop(id(rcol), None)
+
+    def __str__(self):
+        return "%d RCOLs parsed, %d reused, %d cycles" % (self.parses, self.reuses, len(self.cycles))
@@ -47,11 +47,7 @@ class Identifier(Sims2Reader):
         return ident
 
     def get_descriptor(self):
-        #if (self.ver.minor == 2):
-        descriptor = struct.pack('4I', int(self.type), self.group, self.instance, self.resource)
-        #else:
-        #    descriptor = struct.pack('3I', int(self.type), self.group, self.instance1)
-        return descriptor
+        return MakeDescriptor(int(self.type.value), self.group, self.instance, self.resource)
     
     def __str__(self):
         #if (self.ver.minor == 2):
@@ -66,35 +62,64 @@ class Identifier(Sims2Reader):
         #                                                format(self.instance1, '#010x'),
         #                                                self.ver.major, self.ver.minor)
 
+# Descriptors are ints holding type, group, instance and resource as 32 bit fields, least significant first. That's
+# the layout of a descriptor in a DBPF index read as one little-endian number, so a 12 or 16 byte descriptor converts
+# with int.from_bytes, and the type is just the bottom 32 bits.
+DESCRIPTOR_FIELD_MASK = 0xffffffff
+DESCRIPTOR_RESOURCE_SHIFT = 96
+DESCRIPTOR_NO_RESOURCE_MASK = (1 << DESCRIPTOR_RESOURCE_SHIFT) - 1
+
+def MakeDescriptor(typ, group, instance, resource=0):
+    return typ | (group << 32) | (instance << 64) | (resource << DESCRIPTOR_RESOURCE_SHIFT)
+
+def SplitDescriptor(descriptor):
+    """(type, group, instance, resource) as ints"""
+    return (descriptor & DESCRIPTOR_FIELD_MASK, (descriptor >> 32) & DESCRIPTOR_FIELD_MASK,
+            (descriptor >> 64) & DESCRIPTOR_FIELD_MASK, descriptor >> DESCRIPTOR_RESOURCE_SHIFT)
+
+def DescriptorFromBytes(data):
+    """Convert a packed 12 (type, group, instance) or 16 byte descriptor"""
+    if len(data) != 12 and len(data) != 16:
+        raise ValueError("Unexpected descriptor length: %d" % len(data))
+    return int.from_bytes(data, 'little')
+
+def DescriptorToBytes(descriptor):
+    return descriptor.to_bytes(16, 'little')
+
+def ToDescriptor(value):
+    """Convert a descriptor passed in from outside, as packed bytes, a (type, group, instance[, resource]) tuple or
+       an int, to an int"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return DescriptorFromBytes(bytes(value))
+    if isinstance(value, tuple):
+        return MakeDescriptor(*(int(field) for field in value))
+    return value
+
+def WithoutResource(descriptor):
+    return descriptor & DESCRIPTOR_NO_RESOURCE_MASK
+
+def WithResource(descriptor, resource):
+    return (descriptor & DESCRIPTOR_NO_RESOURCE_MASK) | (resource << DESCRIPTOR_RESOURCE_SHIFT)
+
 def DecodeDescriptor(descriptor, verbose=False):
+    descriptor = ToDescriptor(descriptor)
     if verbose:
-        print ("Identifier length is %d" % len(descriptor))
-    if len(descriptor) == 16:    # 4 x 4 bytes
-        data = struct.unpack('4I', descriptor)
-        ver = Version(7, 2)
-    elif len(descriptor) == 12:  # 3 x 4 bytes
-        data = struct.unpack('3I', descriptor)
-        ver = Version(7, 1)
-    else:
-        raise ValueError("Unexpected descriptor length: %d" % len(descriptor))
-    tmp = Identifier(ver)
-    tmp.type = PackedFileType(data[0])
-    tmp.group = data[1]
-    tmp.instance = data[2]
-    if len(descriptor) == 16:
-        tmp.resource = data[3]
-    else:
-        tmp.resource = 0
+        print ("Descriptor is %s" % format(descriptor, '#034x'))
+    tmp = Identifier(Version(7, 2))
+    tmp.type = PackedFileType(descriptor & DESCRIPTOR_FIELD_MASK)
+    tmp.group = (descriptor >> 32) & DESCRIPTOR_FIELD_MASK
+    tmp.instance = (descriptor >> 64) & DESCRIPTOR_FIELD_MASK
+    tmp.resource = descriptor >> DESCRIPTOR_RESOURCE_SHIFT
     return tmp
 
 def GetTypeFromDescriptor(descriptor, verbose=False):
-    return PackedFileType(struct.unpack('I', descriptor[0:4])[0])
+    return PackedFileType(descriptor & DESCRIPTOR_FIELD_MASK)
 
 def GetGroupFromDescriptor(descriptor, verbose=False):
-    return struct.unpack('I', descriptor[4:8])[0]
+    return (descriptor >> 32) & DESCRIPTOR_FIELD_MASK
 
 def GetInstanceFromDescriptor(descriptor, verbose=False):
-    return struct.unpack('I', descriptor[8:12])[0]
+    return (descriptor >> 64) & DESCRIPTOR_FIELD_MASK
 
 class PackedFile(IntEnum):
     cViewRec = 0x0c152b8e
@@ -168,7 +193,10 @@ class PackedFile(IntEnum):
     #@classmethod
     #def _missing_(cls, value):
     #    #raise ValueError("%s is not a valid %s" % (hex(value), cls.__name__))
-    
+
+# Plain integer values of PackedFile, so bulk readers can validate types without constructing enums
+PackedFileValues = frozenset(int(member) for member in PackedFile)
+
 class PackedFileType:
 
     RCOLDict = {}
@@ -291,22 +319,6 @@ class PackedFileType:
     def __str__(self):
         return self.RCOLStrings[self.value]
 
-class IndexEntry(Sims2Reader):
-    """An entry in a Sims 2 Index"""
-
-    def __init__(self, ver=None, fh=None):
-        if fh:
-            self.extract(ver, fh)
-
-    def extract(self, ver, fh):
-        self.identifier = Identifier(ver, fh)
-        data = struct.unpack('2I', fh.read(8)) 
-        self.fileoffset = data[0]
-        self.filesize = data[1]
-            
-    def get_descriptor(self):
-        return self.identifier.get_descriptor()
-
 class FileLink(Sims2Reader):
     """Links from one RCOL to another"""
     
@@ -332,12 +344,7 @@ class FileLink(Sims2Reader):
             self.dump()
 
     def get_descriptor(self, verbose=False):
-        #if self.resource:
-        descriptor = struct.pack('4I', self.type, self.group, self.instance, self.resource)
-        #else:
-            #descriptor = struct.pack('4I', self.type, self.group, self.instance, 0)
-            #descriptor = struct.pack('3I', self.type, self.group, self.instance)
-        return descriptor
+        return MakeDescriptor(self.type, self.group, self.instance, self.resource)
     
     def resolve(self, packman, dbpf, parent_group=None, verbose=False):
         descriptor = self.get_descriptor()
@@ -346,15 +353,15 @@ class FileLink(Sims2Reader):
             print("Resolving filelink, %s" % str(identifier))
 
         # Try same package first
-        self.target = dbpf.get_RCOL(descriptor, verbose)
+        self.target = packman.session.get_RCOL(dbpf, descriptor, verbose)
         if not self.target:
             local_id = copy.copy(identifier)
             if identifier.group != 0xffffffff:
                 local_id.group = 0xffffffff
-                self.target = dbpf.get_RCOL(local_id.get_descriptor(), verbose)
+                self.target = packman.session.get_RCOL(dbpf, local_id.get_descriptor(), verbose)
         if not self.target and identifier.group != parent_group:
             local_id.group = parent_group
-            self.target = dbpf.get_RCOL(local_id.get_descriptor(), verbose)
+            self.target = packman.session.get_RCOL(dbpf, local_id.get_descriptor(), verbose)
             
         # Otherwise try all known packages
         if not self.target:
@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+import array
+import bisect
+
+from blendersims2.fileio.tgir import MakeDescriptor, DESCRIPTOR_FIELD_MASK, DESCRIPTOR_RESOURCE_SHIFT
+
+class TypePartition:
+    """All the resources of one type, sorted by (group, instance, resource), in parallel arrays"""
+
+    def __init__(self, rtype):
+        self.rtype = rtype
+        self.groups = array.array('I')
+        self.instances = array.array('I')
+        self.resources = array.array('I')
+        self.packages = array.array('I')    # Owner ID of the package, as set by the PackageManager
+
+    def get_descriptor(self, position):
+        return MakeDescriptor(self.rtype, self.groups[position], self.instances[position], self.resources[position])
+
+    def group_range(self, group):
+        """(start, end) positions of the entries in group"""
+        start = bisect.bisect_left(self.groups, group)
+        return start, bisect.bisect_right(self.groups, group, start)
+
+    def __len__(self):
+        return len(self.groups)
+
+class TypeIndex:
+    """The global package index partitioned by resource type, so all the resources of one type can be listed without
+       scanning every descriptor, and looked up by group or by group and instance range. Built from the merged
+       descriptor -> package index once all the packages are read, so overridden entries appear only once."""
+
+    def __init__(self):
+        self.partitions = {}    # Type value -> TypePartition
+
+    @staticmethod
+    def sort_key(descriptor, owner):
+        # Reorder the fields so a plain int sort gives (group, instance, resource) order
+        return (((descriptor >> 32) & DESCRIPTOR_FIELD_MASK) << 96 | ((descriptor >> 64) & DESCRIPTOR_FIELD_MASK) << 64 |
+                (descriptor >> DESCRIPTOR_RESOURCE_SHIFT) << 32 | owner)
+
+    @staticmethod
+    def make_partition(rtype, keys):
+        keys.sort()
+        partition = TypePartition(rtype)
+        partition.groups.extend(key >> 96 for key in keys)
+        partition.instances.extend((key >> 64) & DESCRIPTOR_FIELD_MASK for key in keys)
+        partition.resources.extend((key >> 32) & DESCRIPTOR_FIELD_MASK for key in keys)
+        partition.packages.extend(key & DESCRIPTOR_FIELD_MASK for key in keys)
+        return partition
+
+    def build(self, package_index):
+        by_type = {}
+        for descriptor, package in package_index.items():
+            rtype = descriptor & DESCRIPTOR_FIELD_MASK
+            keys = by_type.get(rtype)
+            if keys is None:
+                by_type[rtype] = keys = []
+            keys.append(self.sort_key(descriptor, package.owner))
+        self.partitions = {rtype: self.make_partition(rtype, keys) for rtype, keys in by_type.items()}
+
+    def update(self, package_index, descriptors):
+        """Bring the entries for descriptors, which may have been added, removed or moved to another package, into
+           line with package_index. Only the partitions of the types involved are rebuilt."""
+        by_type = {}
+        for descriptor in descriptors:
+            by_type.setdefault(descriptor & DESCRIPTOR_FIELD_MASK, set()).add(descriptor)
+        for rtype, changed in by_type.items():
+            keys = []
+            partition = self.partitions.get(rtype)
+            if partition:
+                for position in range(len(partition)):
+                    descriptor = partition.get_descriptor(position)
+                    if descriptor not in changed:
+                        keys.append(self.sort_key(descriptor, partition.packages[position]))
+            for descriptor in changed:
+                package = package_index.get(descriptor)
+                if package is not None:
+                    keys.append(self.sort_key(descriptor, package.owner))
+            if keys:
+                self.partitions[rtype] = self.make_partition(rtype, keys)
+            else:
+                self.partitions.pop(rtype, None)
+
+    def count(self, rtype):
+        partition = self.partitions.get(int(rtype))
+        return len(partition) if partition else 0
+
+    def counts(self):
+        """Type value -> number of resources of that type"""
+        return {rtype: len(partition) for rtype, partition in self.partitions.items()}
+
+    def descriptors(self, rtype, group=None, instance_min=None, instance_max=None):
+        """Descriptors of type rtype in (group, instance, resource) order, optionally only those in group and with
+           instance_min <= instance <= instance_max"""
+        partition = self.partitions.get(int(rtype))
+        if not partition:
+            return
+        if group is not None:
+            start, end = partition.group_range(group)
+            # Instances are sorted within a group
+            if instance_min is not None:
+                start = bisect.bisect_left(partition.instances, instance_min, start, end)
+            if instance_max is not None:
+                end = bisect.bisect_right(partition.instances, instance_max, start, end)
+            for position in range(start, end):
+                yield partition.get_descriptor(position)
+        else:
+            instances = partition.instances
+            for position in range(len(partition)):
+                if ((instance_min is None or instances[position] >= instance_min) and
+                        (instance_max is None or instances[position] <= instance_max)):
+                    yield partition.get_descriptor(position)
+
+    def clear(self):
+        self.partitions = {}
+
+    def __len__(self):
+        return sum(len(partition) for partition in self.partitions.values())
+
+    def __str__(self):
+        return "%d resources of %d types" % (len(self), len(self.partitions))
@@ -8,6 +8,7 @@ bl_info = {
 
 import bpy
 
+from blendersims2.fileio.indexer import BackgroundIndexer
 from blendersims2.fileio.package import PackageManager
 from blendersims2.sims2 import AddSims2DirectoriesToPackageManager
 
@@ -15,6 +16,34 @@ from blendersims2.sims2 import AddSims2DirectoriesToPackageManager
 #import imp
 #imp.reload(blendersims2)
 
+# The package manager lives for the whole Blender session, so only the first import has to read the package indices
+_packman = None
+_indexer = None
+
+def GetPackageManager():
+    global _packman
+    if _packman is None:
+        _packman = PackageManager(use_cache=True)
+        AddSims2DirectoriesToPackageManager(_packman)
+    return _packman
+
+def StartIndexing():
+    """Start reading (or refreshing) the package indices in the background, unless that's already happening"""
+    global _indexer
+    if _indexer is None or not _indexer.is_running():
+        _indexer = BackgroundIndexer(GetPackageManager()).start()
+    return _indexer
+
+def ReleasePackageManager():
+    global _packman, _indexer
+    if _indexer is not None:
+        _indexer.cancel()
+        _indexer.wait()
+        _indexer = None
+    if _packman is not None:
+        _packman.close()
+        _packman = None
+
 class Sims2Import(bpy.types.Operator):
     """Sims 2 importer"""              # blender will use this as a tooltip for menu items and buttons.
     bl_idname = "import.sims_2"        # unique identifier for buttons and menu items to reference.
@@ -24,31 +53,65 @@ class Sims2Import(bpy.types.Operator):
     # Set this before calling file selector to set the default search path. After file selector it will
     # store the file selected
     filepath = bpy.props.StringProperty(subtype='DIR_PATH') 
+    # Rescan the search directories for added, changed or removed packages even if the indices are already loaded
+    refresh = bpy.props.BoolProperty(default=False)
 
     def execute(self, context):
         """execute() is called by Blender when running the operator."""
 
-        self.report({'INFO'}, "Found %d RCOLs" % len(self.packman.package_index))
+        self.report({'INFO'}, "Found %d RCOLs" % len(GetPackageManager().package_index))
 
         return {'FINISHED'}
 
     def invoke(self, context, event):
-        """invoke() is the first function called on the operator. Here the package manager is initialised
-           and packages are read. print functions will output to the console."""
+        """invoke() is the first function called on the operator. Here the package manager is initialised and, the
+           first time round, packages are read on a background thread while the operator shows progress. ESC cancels
+           reading. print functions will output to the console."""
            
-        self.packman = PackageManager()
-        AddSims2DirectoriesToPackageManager(self.packman)
-        self.packman.ReadDBPFIndices()
-        print("Found %d RCOLs" % len(self.packman.package_index))
-        return self.execute(context)
+        packman = GetPackageManager()
+        if packman.packages and not self.refresh and (_indexer is None or not _indexer.is_running()):
+            return self.execute(context)
+        self.indexer = StartIndexing()
+        wm = context.window_manager
+        self.timer = wm.event_timer_add(0.1, window=context.window)
+        wm.progress_begin(0, 100)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
         #context.window_manager.fileselect_add(self)
         #return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            # Don't wait here, which would freeze the UI; the worker stops at its next check and a TIMER event ends
+            # the operator
+            self.indexer.cancel()
+            return {'RUNNING_MODAL'}
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+        if not self.indexer.finished.is_set():
+            context.window_manager.progress_update(int(self.indexer.fraction() * 100))
+            return {'RUNNING_MODAL'}
+        self.finish(context)
+        print("Indexing %s in %.1fs" % (str(self.indexer), self.indexer.elapsed))
+        if self.indexer.error is not None:
+            self.report({'ERROR'}, "Reading packages failed")
+            return {'CANCELLED'}
+        if self.indexer.cancelled:
+            self.report({'WARNING'}, "Reading packages cancelled")
+            return {'CANCELLED'}
+        return self.execute(context)
+
+    def finish(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self.timer)
+        wm.progress_end()
     
 def register():
     bpy.utils.register_class(Sims2Import)
 
 def unregister():
     bpy.utils.unregister_class(Sims2Import)
+    ReleasePackageManager()
 
 # This allows you to run the script directly from blenders text editor
 # to test the addon without having to install it.
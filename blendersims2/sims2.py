@@ -50,7 +50,7 @@ def AddSims2DirectoriesToPackageManager(packman):
 
 def CheckAllCRES(verbose=True, starting_point=0):
     
-    packman = PackageManager()
+    packman = PackageManager(use_cache=True)
     AddSims2DirectoriesToPackageManager(packman)
     packman.ReadDBPFIndices()
     unsupported = []
@@ -71,6 +71,7 @@ def CheckAllCRES(verbose=True, starting_point=0):
         print("Unsupported RCOL formats:")
         for rcol_type in unsupported:
             print("    %s" % str(rcol_type))
+    packman.close()
     return index
 
 def spag():
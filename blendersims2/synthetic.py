@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+import os
+import random
+import struct
+
+from blendersims2.fileio import qfs
+from blendersims2.fileio.crcutils import sims2crc32
+from blendersims2.fileio.tgir import PackedFile
+from blendersims2.fileio.rcol.gmdc import ElemIdent, BlockFormat, SetGroup
+
+# Fixture generator for benchmarks: writes DBPF packages with the same layout as the game's, so the readers can be
+# exercised without a Sims 2 install. The Encode functions are the inverses of the corresponding RCOL readers.
+
+def EncodeName(name):
+    """Inverse of ParseName: 7 bit variable length prefix followed by ASCII"""
+    data = name.encode('ascii')
+    length = len(data)
+    prefix = bytearray()
+    while length >= 0x80:
+        prefix.append((length & 0x7f) | 0x80)
+        length >>= 7
+    prefix.append(length)
+    return bytes(prefix) + data
+
+def EncodeNode(name, node_type, version):
+    return EncodeName(name) + struct.pack('2I', int(node_type), version)
+
+def EncodeSGResource(filename, version=2):
+    return EncodeNode('cSGResource', 0, version) + EncodeName(filename)
+
+def EncodeChain(enabled, subnode, node):
+    return struct.pack('=2BI', int(enabled), int(subnode), node)
+
+def EncodeObjectGraphNode(extensions=(), version=4, resourcename=''):
+    data = EncodeNode('cObjectGraphNode', 0, version) + struct.pack('I', len(extensions))
+    data += b''.join(EncodeChain(*chain) for chain in extensions)
+    if version == 4:
+        data += EncodeName(resourcename)
+    return data
+
+def EncodeRCOLHeader(filelinks, rcol_ids):
+    """filelinks is a list of (type, group, instance, resource). Always writes the 0xFFFF0001 form with resource IDs."""
+    data = struct.pack('2I', 0xFFFF0001, len(filelinks))
+    for typ, group, instance, resource in filelinks:
+        data += struct.pack('4I', group, instance, resource, int(typ))
+    data += struct.pack('I', len(rcol_ids))
+    data += b''.join(struct.pack('I', int(rcol_id)) for rcol_id in rcol_ids)
+    return data
+
+def EncodeTransformNode(name, index, rng):
+    data = EncodeNode('cTransformNode', PackedFile.cTran, 7)
+    data += EncodeNode('cCompositionTreeNode', 0, 11)
+    data += EncodeObjectGraphNode([(True, False, index)], 4, name)
+    data += struct.pack('I', 2) + EncodeChain(True, True, index + 1) + EncodeChain(True, False, index + 2)
+    data += struct.pack('3f', *(rng.uniform(-1.0, 1.0) for _ in range(3)))
+    data += struct.pack('4f', 0.0, 0.0, 0.0, 1.0)
+    data += struct.pack('I', index)
+    return data
+
+def EncodeCRES(name, transforms=0, rng=None):
+    """Returns the RCOL blocks for a CRES: the cResourceNode followed by a chain of cTransformNodes"""
+    data = EncodeNode('cResourceNode', PackedFile.CRES, 7) + struct.pack('B', 1)
+    data += EncodeSGResource(name)
+    data += EncodeNode('cCompositionTreeNode', 0, 11)
+    data += EncodeObjectGraphNode([(True, False, 1)], 4, '')
+    data += struct.pack('I', transforms)
+    data += b''.join(EncodeChain(True, True, index + 1) for index in range(transforms))
+    data += struct.pack('=BI', 0, 0)
+    rng = rng or random.Random(0)
+    blocks = [(PackedFile.CRES, data)]
+    for index in range(transforms):
+        blocks.append((PackedFile.cTran, EncodeTransformNode('%s_bone%d' % (name, index), index, rng)))
+    return blocks
+
+def EncodeSHPE(name, gmnd_names):
+    data = EncodeNode('cShape', PackedFile.SHPE, 8)
+    data += EncodeSGResource(name)
+    data += EncodeNode('cReferentNode', 0, 1)
+    data += EncodeObjectGraphNode([], 4, '')
+    data += struct.pack('I', len(gmnd_names)) + struct.pack('%dI' % len(gmnd_names), *range(len(gmnd_names)))
+    data += struct.pack('I', len(gmnd_names))
+    for lod, gmnd_name in enumerate(gmnd_names):
+        data += struct.pack('=IB', lod, 1) + EncodeName(gmnd_name)
+    data += struct.pack('I', 1) + EncodeName('body') + EncodeName('%s_txmt' % name) + struct.pack('=IBI', 0, 0, 0)
+    return data
+
+def EncodeGMND(name):
+    data = EncodeNode('cGeometryNode', PackedFile.GMND, 12)
+    data += EncodeObjectGraphNode([], 4, '')
+    data += EncodeSGResource(name)
+    data += struct.pack('=HB', 1, 1)    # Assisted geometry, unknown
+    data += struct.pack('I', 0)        # No attached RCOLs
+    return data
+
+def EncodeGMDC(name, vertices=1000, faces=None, version=4, rng=None):
+    rng = rng or random.Random(0)
+    faces = faces if faces is not None else vertices * 2
+    index = 'H' if version == 4 else 'I'
+    count = lambda n: struct.pack('I', n)
+    indices = lambda values: struct.pack('%d%s' % (len(values), index), *values)
+
+    data = EncodeNode('cGeometryDataContainer', PackedFile.GMDC, version)
+    data += EncodeSGResource(name)
+
+    # Elements: vertices, normals, UVs and bone assignments
+    elements = [(ElemIdent.VERTICES, BlockFormat.ThreeFloat, SetGroup.Main),
+                (ElemIdent.NORMALS_LIST, BlockFormat.ThreeFloat, SetGroup.Norms),
+                (ElemIdent.UV_COORDINATES, BlockFormat.TwoFloat, SetGroup.UV),
+                (ElemIdent.BONE_ASSIGNMENTS, BlockFormat.OneDWORD, SetGroup.Secondary)]
+    data += count(len(elements))
+    for identity, block_format, set_group in elements:
+        setlength = block_format.block_size()
+        if block_format == BlockFormat.OneDWORD:
+            block = struct.pack('%dI' % vertices, *(rng.randrange(4) for _ in range(vertices)))
+        else:
+            block = struct.pack('%df' % (vertices * setlength), *(round(rng.uniform(-1.0, 1.0), 3) for _ in range(vertices * setlength)))
+        data += struct.pack('6I', vertices, int(identity), 0, int(block_format), int(set_group), len(block)) + block
+        data += count(4) + indices([0, 1, 2, 3])
+
+    # One linkage referencing all the elements
+    data += count(1)
+    data += count(len(elements)) + indices(list(range(len(elements)))) + struct.pack('2I', vertices, vertices)
+    data += count(0) + count(0) + count(0)
+
+    # One group containing all the faces
+    face_indices = [rng.randrange(min(vertices, 0xffff)) for _ in range(faces * 3)]
+    data += count(1) + struct.pack('2I', 2, 0) + EncodeName('%s_group' % name)
+    data += count(len(face_indices)) + indices(face_indices) + struct.pack('I', 0xffffffff)
+    data += count(2) + indices([0, 1])
+
+    # Model with a couple of transforms and an empty subset
+    data += count(2)
+    for _ in range(2):
+        data += struct.pack('4f', 0.0, 0.0, 0.0, 1.0) + struct.pack('3f', 0.0, 1.0, 0.0)
+    data += count(1) + EncodeName('blend') + EncodeName('target')
+    data += count(0)
+
+    # Per-bone subsets
+    data += count(2)
+    for _ in range(2):
+        data += count(3) + count(3) + struct.pack('9I', *range(9)) + indices([0, 1, 2])
+    return data
+
+def EncodeRCOL(filelinks, blocks):
+    """blocks is a list of (type, encoded block)"""
+    return EncodeRCOLHeader(filelinks, [typ for typ, _ in blocks]) + b''.join(block for _, block in blocks)
+
+def EncodeNMAP(names):
+    """names is a list of (group, instance, name)"""
+    data = struct.pack('I', len(names))
+    for group, instance, name in names:
+        encoded = name.encode('ascii')
+        data += struct.pack('3I', group, instance, len(encoded)) + encoded
+    return data
+
+def WriteDBPF(path, entries, minor=2, compress=True):
+    """Write a DBPF 7.1 or 7.2 package. entries is a list of (type, group, instance, resource, data, compressible).
+       Compressed entries are listed in a CLST directory."""
+    descriptor = (lambda t, g, i, r: struct.pack('4I', t, g, i, r)) if minor == 2 else (lambda t, g, i, r: struct.pack('3I', t, g, i))
+    body = bytearray(96)
+    index = []
+    clst = []
+    for typ, group, instance, resource, data, compressible in entries:
+        typ = int(typ)
+        if compress and compressible:
+            clst.append(descriptor(typ, group, instance, resource) + struct.pack('I', len(data)))
+            data = qfs.compress(data)
+        index.append((typ, group, instance, resource, len(body), len(data)))
+        body += data
+    if clst:
+        data = b''.join(clst)
+        index.append((int(PackedFile.CLST), 0xe86b1eef, 0x286b1f03, 0, len(body), len(data)))
+        body += data
+    indexoffset = len(body)
+    for typ, group, instance, resource, offset, size in index:
+        body += descriptor(typ, group, instance, resource) + struct.pack('2I', offset, size)
+    header = [1, 1, 0, 0, 0, 0, 0, 7, len(index), indexoffset, len(body) - indexoffset, 0, 0, 0, minor, 0, 0, 0, 0, 0, 0, 0]
+    body[0:92] = b'DBPF' + struct.pack('22I', *header)
+    with open(path, 'wb') as fh:
+        fh.write(body)
+    return path
+
+def BuildChainPackage(path, chains=10, vertices=1000, transforms=4, lods=1, minor=2, compress=True, nmap=True, seed=0):
+    """Write a package of CRES -> SHPE -> GMND -> GMDC chains. CRESs link to their SHPE, SHPE LODs name their GMNDs
+       (looked up through an NMAP if nmap is set) and GMNDs link to their GMDC. Returns the CRES descriptors as
+       (type, group, instance, resource) tuples."""
+    rng = random.Random(seed)
+    group = 0x1c050000 + seed
+    entries = []
+    gmnd_names = []
+    cres_ids = []
+    for chain in range(chains):
+        base = 'synth%d_chain%d' % (seed, chain)
+        resource = lambda name: sims2crc32(name.lower().encode('ascii')) if minor == 2 else 0
+        gmdc_name = base + '_tslocator_gmdc'
+        gmdc = (PackedFile.GMDC, group, 0xff000000 + chain, resource(gmdc_name))
+        entries.append(gmdc + (EncodeRCOL([], [(PackedFile.GMDC, EncodeGMDC(gmdc_name, vertices, rng=rng))]), True))
+
+        names = []
+        for lod in range(lods):
+            gmnd_name = '%s_lod%d_tslocator_gmnd' % (base, lod)
+            gmnd = (PackedFile.GMND, group, 0xfe000000 + chain * 16 + lod, resource(gmnd_name))
+            entries.append(gmnd + (EncodeRCOL([gmdc], [(PackedFile.GMND, EncodeGMND(gmnd_name))]), True))
+            gmnd_names.append((group, gmnd[2], gmnd_name))
+            names.append(gmnd_name)
+
+        shpe_name = base + '_shpe'
+        shpe = (PackedFile.SHPE, group, 0xfd000000 + chain, resource(shpe_name))
+        entries.append(shpe + (EncodeRCOL([], [(PackedFile.SHPE, EncodeSHPE(shpe_name, names))]), True))
+
+        cres_name = base + '_cres'
+        cres = (PackedFile.CRES, group, 0xfc000000 + chain, resource(cres_name))
+        entries.append(cres + (EncodeRCOL([shpe], EncodeCRES(cres_name, transforms, rng)), True))
+        cres_ids.append(cres[:4])
+    if nmap:
+        entries.append((PackedFile.NMAP, 0x4e6d6150, int(PackedFile.GMND), 0, EncodeNMAP(gmnd_names), False))
+    WriteDBPF(path, entries, minor, compress)
+    return cres_ids
+
+def BuildCorpus(directory, packages=4, chains=10, vertices=1000, transforms=4, lods=1, compress=True):
+    """Write a directory of chain packages, alternating DBPF index versions 7.1 and 7.2, every third without an NMAP"""
+    os.makedirs(directory, exist_ok=True)
+    cres_ids = []
+    for number in range(packages):
+        path = os.path.join(directory, 'synthetic%03d.package' % number)
+        cres_ids.extend(BuildChainPackage(path, chains, vertices, transforms, lods, minor=(2 if number % 2 == 0 else 1),
+                                          compress=compress, nmap=(number % 3 != 2), seed=number))
+    return cres_ids